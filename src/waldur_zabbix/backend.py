@@ -1,14 +1,24 @@
+import hashlib
+import itertools
+import json
+import os
 import sys
 import logging
+import operator
 import pyzabbix
+import random
 import requests
+import threading
+import time
 import warnings
 
+from collections import deque
 from datetime import date, timedelta
 from decimal import Decimal
 
 from django.conf import settings as django_settings
-from django.db import connections, DatabaseError
+from django.core.cache import cache
+from django.db import transaction, DatabaseError
 from django.utils import six, timezone
 from requests.exceptions import RequestException
 from requests.packages.urllib3 import exceptions
@@ -18,6 +28,7 @@ from waldur_core.structure import ServiceBackend, ServiceBackendError, log_backe
 from waldur_core.structure.utils import update_pulled_fields
 
 from . import models, utils
+from .database import db_pools, replica_monitor, QueryTimeoutError, ZabbixQueryResult
 
 
 logger = logging.getLogger(__name__)
@@ -40,6 +51,10 @@ class ZabbixBackendError(ServiceBackendError):
     pass
 
 
+class ZabbixQueryTimeoutError(ZabbixBackendError):
+    pass
+
+
 class QuietSession(requests.Session):
     """Session class that suppresses warning about unsafe TLS sessions and clogging the logs.
     Inspired by: https://github.com/kennethreitz/requests/issues/2214#issuecomment-110366218
@@ -55,6 +70,257 @@ class QuietSession(requests.Session):
             return super(QuietSession, self).request(*args, **kwargs)
 
 
+class ZabbixAPIPool(object):
+    """
+    Per-process cache of authenticated Zabbix API clients.
+    Client is shared by all backends of the same service settings, so HTTP connections
+    are kept alive and user.login is called only once instead of once per backend.
+    """
+    # Zabbix returns these errors if auth token has expired or has been invalidated.
+    AUTH_ERRORS = ('re-login', 'Not authorised', 'Not authorized')
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def get(self, settings, factory):
+        key = settings.uuid.hex
+        credentials = (settings.backend_url, settings.username, settings.password)
+        with self._lock:
+            if self._pid != os.getpid():
+                # Connections should not be shared with parent process after fork.
+                self._clients = {}
+                self._pid = os.getpid()
+            if key in self._clients and self._clients[key][0] == credentials:
+                return self._clients[key][1]
+
+        api = factory(*credentials)
+        self._enable_relogin(api, settings.username, settings.password)
+        with self._lock:
+            self._clients[key] = (credentials, api)
+        return api
+
+    def invalidate(self, settings):
+        with self._lock:
+            credentials, api = self._clients.pop(settings.uuid.hex, (None, None))
+        if api is not None:
+            api.session.close()
+
+    def _enable_relogin(self, api, username, password):
+        """ Login again and repeat request if auth token has expired """
+        do_request = api.do_request
+
+        def do_request_with_relogin(method, params=None):
+            try:
+                return do_request(method, params)
+            except pyzabbix.ZabbixAPIException as e:
+                if method == 'user.login' or not any(error in six.text_type(e) for error in self.AUTH_ERRORS):
+                    raise
+                logger.info('Zabbix auth token for user %s has expired, logging in again.', username)
+                api.login(username, password)
+                return do_request(method, params)
+
+        api.do_request = do_request_with_relogin
+
+
+api_pool = ZabbixAPIPool()
+
+
+class ZabbixResponseCache(object):
+    """
+    Short-lived cache of Zabbix responses shared between processes via Django cache.
+    Concurrent identical calls are coalesced: only one of them reaches Zabbix,
+    others wait for its result. Threads of the same process wait on in-flight call,
+    other processes wait until the call holding cache lock stores the response.
+    """
+    LOCK_POLL_INTERVAL = 0.1
+
+    class InFlightCall(object):
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.exc_info = None
+
+        def wait(self):
+            self.done.wait()
+            if self.exc_info is not None:
+                six.reraise(*self.exc_info)
+            return self.result
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, timeout, func):
+        """ Return cached response or call func to get it. Responses must not be None. """
+        if not timeout:
+            return func()
+
+        result = cache.get(key)
+        if result is not None:
+            return result
+
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = self.InFlightCall()
+        if not is_leader:
+            return call.wait()
+
+        try:
+            call.result = self._fetch(key, timeout, func)
+        except Exception:
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def _fetch(self, key, timeout, func):
+        lock_key = key + ':lock'
+        is_locked = cache.add(lock_key, os.getpid(), timeout)
+        if not is_locked:
+            # Another process fetches the same response, wait until it is stored.
+            deadline = time.time() + timeout
+            while time.time() < deadline:
+                time.sleep(self.LOCK_POLL_INTERVAL)
+                result = cache.get(key)
+                if result is not None:
+                    return result
+                if cache.get(lock_key) is None:
+                    break
+
+        try:
+            result = func()
+            cache.set(key, result, timeout)
+        finally:
+            if is_locked:
+                cache.delete(lock_key)
+        return result
+
+
+response_cache = ZabbixResponseCache()
+
+
+class ZabbixAPIBatchResult(object):
+    """ Placeholder for result of API call that is executed as a part of batch request """
+
+    def __init__(self, method, params):
+        self.method = method
+        self.params = params
+        self._response = None
+
+    def set_response(self, response):
+        self._response = response
+
+    @property
+    def result(self):
+        if self._response is None:
+            raise pyzabbix.ZabbixAPIException('Batch request with %s call has not been executed.' % self.method)
+        if 'error' in self._response:
+            error = self._response['error']
+            message = 'Error %s: %s, %s' % (error.get('code'), error.get('message'), error.get('data', 'No data'))
+            raise pyzabbix.ZabbixAPIException(message, error.get('code'))
+        return self._response['result']
+
+
+class ZabbixAPIBatch(object):
+    """
+    Collect several Zabbix API calls and send them in one JSON-RPC batch request.
+
+    Usage example:
+        with backend.batch() as batch:
+            groups = batch.call('hostgroup.get', filter={'name': 'waldur'})
+            hosts = batch.call('host.get', output='hostid')
+        print(groups.result, hosts.result)
+    """
+
+    def __init__(self, api, username, password):
+        self.api = api
+        self.username = username
+        self.password = password
+        self.calls = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+    def call(self, method, **params):
+        result = ZabbixAPIBatchResult(method, params)
+        self.calls.append(result)
+        return result
+
+    def execute(self):
+        calls, self.calls = self.calls, []
+        if not calls:
+            return
+
+        responses = self._send(calls)
+        if any(self._is_auth_error(response) for response in responses.values()):
+            logger.info('Zabbix auth token for user %s has expired, logging in again.', self.username)
+            self.api.login(self.username, self.password)
+            responses = self._send(calls)
+
+        for index, call in enumerate(calls):
+            try:
+                call.set_response(responses[index])
+            except KeyError:
+                raise pyzabbix.ZabbixAPIException('Batch response does not contain result of %s call.' % call.method)
+
+    def _send(self, calls):
+        payload = []
+        for index, call in enumerate(calls):
+            request = {'jsonrpc': '2.0', 'method': call.method, 'params': call.params, 'id': index}
+            if self.api.auth:
+                request['auth'] = self.api.auth
+            payload.append(request)
+
+        response = self.api.session.post(self.api.url, data=json.dumps(payload), timeout=self.api.timeout)
+        response.raise_for_status()
+        try:
+            return {item['id']: item for item in response.json()}
+        except (ValueError, TypeError, KeyError):
+            raise pyzabbix.ZabbixAPIException('Unable to parse batch response: %s' % response.text)
+
+    def _is_auth_error(self, response):
+        error = response.get('error')
+        if not error:
+            return False
+        message = '%s %s' % (error.get('message'), error.get('data'))
+        return any(auth_error in message for auth_error in ZabbixAPIPool.AUTH_ERRORS)
+
+
+class ItemsHistoryReader(object):
+    """
+    Read values of items from stream of (<itemid>, <values>) pairs sorted by item ID.
+    Items should be requested in ascending order of IDs, values of skipped items are discarded.
+    """
+
+    def __init__(self, items_history):
+        self._items_history = iter(items_history)
+        self._current = next(self._items_history, None)
+
+    def get(self, itemid):
+        while self._current is not None and self._current[0] < itemid:
+            self._current = next(self._items_history, None)
+        if self._current is not None and self._current[0] == itemid:
+            return self._current[1]
+        return iter([])
+
+    def close(self):
+        """ Read the rest of values, so streamed query is completed and its connection can be reused. """
+        for _ in self._items_history:
+            pass
+        self._current = None
+
+
 class ZabbixBackend(ServiceBackend):
 
     DEFAULTS = {
@@ -79,11 +345,51 @@ class ZabbixBackend(ServiceBackend):
         'sms_email_rcpt': sms_settings.get('SMS_EMAIL_RCPT'),
     }
 
+    API_CONNECTIONS_POOL_SIZE = 10
+    # Defaults of Zabbix DB connection pool, can be overridden in database parameters
+    DB_POOL_SIZE = 10
+    DB_POOL_IDLE_TIMEOUT = 300
+    DB_POOL_WAIT_TIMEOUT = 30
+    # Replicas which are lagging behind primary database for longer are not used
+    DB_MAX_REPLICATION_LAG = 30
+    # Number of rows that are fetched at once by unbuffered cursor
+    DB_STREAM_CHUNK_SIZE = 1000
     TREND_DELAY_SECONDS = 60 * 60  # One hour
     HISTORY_DELAY_SECONDS = 15 * 60
+    # Queries which take longer are logged as warnings
+    SLOW_QUERY_SECONDS = 5
+    # Number of the latest executed queries whose durations are kept by backend
+    QUERY_DURATIONS_SIZE = 100
+    # Item values older than this delay are not changed anymore, so they can be cached
+    STATS_CACHE_DELAY_SECONDS = 5 * 60
+    # Aggregated values are cached for hourly buckets aligned with trends
+    STATS_CACHE_BUCKET_SECONDS = 60 * 60
+    # Requests that need more cache entries are served by Zabbix DB directly
+    STATS_CACHE_MAX_KEYS = 10000
+    # Functions to combine values aggregated from history and trends tables
+    AGGREGATION_COMBINERS = {
+        'MIN': min,
+        'MAX': max,
+    }
+    DOWNSAMPLING_METHODS = {
+        'avg': 'AVG(%(column)s)',
+        'min': 'MIN(%(column)s)',
+        'max': 'MAX(%(column)s)',
+        # Value of the latest row of bucket, it is selected by join with MAX(clock) of bucket
+        'last': '%(column)s',
+    }
+    # Triggers are returned in the same order with and without pagination
+    TRIGGERS_ORDERING = {
+        'sortfield': ['lastchange', 'triggerid'],
+        'sortorder': 'DESC',
+    }
 
     def __init__(self, settings):
         self.settings = settings
+        # Execution time limit of Zabbix DB queries in seconds, can be changed for particular endpoint
+        self.query_timeout = utils.get_query_timeout()
+        # (<query>, <duration in seconds>) pairs of the latest executed Zabbix DB queries
+        self.query_durations = deque(maxlen=self.QUERY_DURATIONS_SIZE)
 
     @property
     def host_group_name(self):
@@ -104,11 +410,13 @@ class ZabbixBackend(ServiceBackend):
     @property
     def api(self):
         if not hasattr(self, '_api'):
-            self._api = self._get_api(self.settings.backend_url,
-                                      self.settings.username,
-                                      self.settings.password)
+            self._api = api_pool.get(self.settings, self._get_api)
         return self._api
 
+    def batch(self):
+        """ Start collecting API calls that will be sent to Zabbix in one request """
+        return ZabbixAPIBatch(self.api, self.settings.username, self.settings.password)
+
     def ping(self, raise_exception=False):
         try:
             self.api.api_version()
@@ -121,7 +429,7 @@ class ZabbixBackend(ServiceBackend):
 
     def sync(self):
         self._get_or_create_group_id(self.host_group_name)
-        self.pull_templates()
+        self.pull_templates(incremental=True)
         self.pull_user_groups()
         self.pull_users()
         for name in self.templates_names:
@@ -214,51 +522,138 @@ class ZabbixBackend(ServiceBackend):
         except (pyzabbix.ZabbixAPIException, RequestException) as e:
             six.reraise(ZabbixBackendError, e)
 
-    def pull_templates(self):
-        """ Update existing Waldur templates and their items """
+    def pull_templates(self, incremental=False):
+        """ Update existing Waldur templates and their items
+
+        In incremental mode templates are listed with fields of their fingerprint only,
+        full details are requested only for templates with changed fingerprint.
+        Item names are not part of fingerprint, so renaming of items alone is pulled only in full mode.
+        """
         logger.debug('About to pull zabbix templates from backend.')
+        details = dict(
+            output=['name', 'templateid'],
+            selectTriggers=['description', 'triggerid', 'priority'],
+            selectItems=['itemid', 'name', 'key_', 'value_type', 'units', 'history', 'delay'],
+            selectTemplates=['templateid'],
+        )
         try:
-            zabbix_templates = self.api.template.get(
-                output=['name', 'templateid'],
-                selectTriggers=['description', 'triggerid', 'priority'],
-                selectItems=['itemid', 'name', 'key_', 'value_type', 'units', 'history', 'delay'],
-                selectTemplates=['templateid'],
-            )
+            if incremental:
+                listed_templates = self.api.template.get(
+                    output=['name', 'templateid'],
+                    selectTriggers=['description', 'triggerid', 'priority'],
+                    selectItems=['itemid', 'key_', 'value_type', 'units', 'history', 'delay'],
+                    selectTemplates=['templateid'],
+                )
+                fingerprints = dict(models.Template.objects.filter(settings=self.settings).values_list(
+                    'backend_id', 'fingerprint'))
+                changed_templates_ids = [t['templateid'] for t in listed_templates
+                                         if fingerprints.get(t['templateid']) != self._get_template_fingerprint(t)]
+                zabbix_templates = []
+                if changed_templates_ids:
+                    zabbix_templates = self.api.template.get(templateids=changed_templates_ids, **details)
+            else:
+                listed_templates = zabbix_templates = self.api.template.get(**details)
         except (pyzabbix.ZabbixAPIException, RequestException) as e:
             raise ZabbixBackendError('Cannot pull templates. Exception: %s' % e)
 
-        # Delete stale templates
-        zabbix_templates_ids = set([t['templateid'] for t in zabbix_templates])
-        models.Template.objects.filter(settings=self.settings).exclude(backend_id__in=zabbix_templates_ids).delete()
+        with transaction.atomic():
+            # Delete stale templates
+            zabbix_templates_ids = set([t['templateid'] for t in listed_templates])
+            models.Template.objects.filter(settings=self.settings).exclude(
+                backend_id__in=zabbix_templates_ids).delete()
 
-        # Update or create zabbix templates
-        for zabbix_template in zabbix_templates:
-            nc_template, created = models.Template.objects.get_or_create(
-                backend_id=zabbix_template['templateid'],
-                settings=self.settings,
-                defaults={'name': zabbix_template['name']})
-            if not created and nc_template.name != zabbix_template['name']:
-                nc_template.name = zabbix_template['name']
-                nc_template.save()
+            templates = self._sync_templates(zabbix_templates)
+            self._sync_templates_triggers(zabbix_templates, templates)
+            self._sync_templates_items(zabbix_templates, templates)
+            self._sync_templates_children(zabbix_templates, templates)
 
-            # Delete stale triggers
-            zabbix_triggers_ids = set([i['triggerid'] for i in zabbix_template['triggers']])
-            nc_template.triggers.exclude(backend_id__in=zabbix_triggers_ids).delete()
-
-            # Update or create triggers
-            for zabbix_trigger in zabbix_template['triggers']:
-                nc_template.triggers.update_or_create(
-                    backend_id=zabbix_trigger['triggerid'],
-                    priority=int(zabbix_trigger['priority']),  # according to Zabbix model it must always be integer
-                    settings=nc_template.settings,
-                    defaults={'name': zabbix_trigger['description']})
+        logger.debug('%s of %s Zabbix templates have been updated.', len(zabbix_templates), len(listed_templates))
+        logger.info('Successfully pulled Zabbix templates for settings %s', self.settings)
 
-            # Delete stale items
-            zabbix_items_ids = set([i['itemid'] for i in zabbix_template['items']])
-            nc_template.items.exclude(backend_id__in=zabbix_items_ids).delete()
+    def _get_template_fingerprint(self, zabbix_template):
+        """ Compact representation of template structure that changes if template, its items or triggers change """
+        content = json.dumps([
+            zabbix_template['name'],
+            sorted([i['itemid'], i['key_'], i['value_type'], i['units'], i['history'], i['delay']]
+                   for i in zabbix_template['items']),
+            sorted([t['triggerid'], t['description'], t['priority']] for t in zabbix_template['triggers']),
+            sorted(t['templateid'] for t in zabbix_template['templates']),
+        ])
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def _sync_templates(self, zabbix_templates):
+        """ Create or update templates. Returns map <template backend_id> -> template """
+        def get_templates():
+            return {t.backend_id: t for t in models.Template.objects.filter(settings=self.settings)}
+
+        templates = get_templates()
+        new_templates = []
+        changed_templates = []
+        for zabbix_template in zabbix_templates:
+            nc_template = templates.get(zabbix_template['templateid'])
+            name = zabbix_template['name']
+            fingerprint = self._get_template_fingerprint(zabbix_template)
+            if nc_template is None:
+                new_templates.append(models.Template(
+                    settings=self.settings, backend_id=zabbix_template['templateid'], name=name,
+                    fingerprint=fingerprint))
+            elif nc_template.name != name or nc_template.fingerprint != fingerprint:
+                nc_template.name = name
+                nc_template.fingerprint = fingerprint
+                changed_templates.append(nc_template)
+
+        utils.bulk_update(changed_templates, ['name', 'fingerprint'])
+        if new_templates:
+            models.Template.objects.bulk_create(new_templates)
+            # primary keys of created objects are not available for MySQL
+            templates = get_templates()
+        return templates
+
+    def _sync_templates_triggers(self, zabbix_templates, templates):
+        nc_triggers = models.Trigger.objects.filter(
+            settings=self.settings, template__backend_id__in=[t['templateid'] for t in zabbix_templates])
+        nc_triggers = {(t.template_id, t.backend_id): t for t in nc_triggers}
 
-            # Update or create zabbix items
+        new_triggers = []
+        changed_triggers = []
+        actual_keys = set()
+        for zabbix_template in zabbix_templates:
+            nc_template = templates[zabbix_template['templateid']]
+            for zabbix_trigger in zabbix_template['triggers']:
+                key = (nc_template.pk, zabbix_trigger['triggerid'])
+                actual_keys.add(key)
+                name = zabbix_trigger['description']
+                priority = int(zabbix_trigger['priority'])  # according to Zabbix model it must always be integer
+                nc_trigger = nc_triggers.get(key)
+                if nc_trigger is None:
+                    new_triggers.append(models.Trigger(
+                        template=nc_template, settings=self.settings, backend_id=zabbix_trigger['triggerid'],
+                        name=name, priority=priority))
+                elif nc_trigger.name != name or nc_trigger.priority != priority:
+                    nc_trigger.name = name
+                    nc_trigger.priority = priority
+                    changed_triggers.append(nc_trigger)
+
+        # Delete stale triggers
+        stale_triggers = [t.pk for key, t in nc_triggers.items() if key not in actual_keys]
+        if stale_triggers:
+            models.Trigger.objects.filter(pk__in=stale_triggers).delete()
+        utils.bulk_update(changed_triggers, ['name', 'priority'])
+        models.Trigger.objects.bulk_create(new_triggers)
+
+    def _sync_templates_items(self, zabbix_templates, templates):
+        nc_items = models.Item.objects.filter(
+            template__settings=self.settings, template__backend_id__in=[t['templateid'] for t in zabbix_templates])
+        nc_items = {(i.template_id, i.backend_id): i for i in nc_items}
+
+        new_items = []
+        changed_items = []
+        actual_keys = set()
+        for zabbix_template in zabbix_templates:
+            nc_template = templates[zabbix_template['templateid']]
             for zabbix_item in zabbix_template['items']:
+                key = (nc_template.pk, zabbix_item['itemid'])
+                actual_keys.add(key)
                 defaults = {
                     'name': zabbix_item['name'],
                     'key': zabbix_item['key_'],
@@ -267,28 +662,42 @@ class ZabbixBackend(ServiceBackend):
                     'history': utils.parse_time(zabbix_item['history']),
                     'delay': utils.parse_time(zabbix_item['delay'])
                 }
-
-                nc_item, created = nc_template.items.get_or_create(
-                    backend_id=zabbix_item['itemid'], defaults=defaults)
-                if not created:
-                    update_fields = []
-                    for (name, value) in defaults.items():
-                        if getattr(nc_item, name) != value:
-                            setattr(nc_item, name, value)
-                            update_fields.append(name)
-                    if update_fields:
-                        nc_item.save(update_fields=update_fields)
-
-        # Initialize templates children
+                nc_item = nc_items.get(key)
+                if nc_item is None:
+                    new_items.append(models.Item(template=nc_template, backend_id=zabbix_item['itemid'], **defaults))
+                elif any(getattr(nc_item, name) != value for name, value in defaults.items()):
+                    for name, value in defaults.items():
+                        setattr(nc_item, name, value)
+                    changed_items.append(nc_item)
+
+        # Delete stale items
+        stale_items = [i.pk for key, i in nc_items.items() if key not in actual_keys]
+        if stale_items:
+            models.Item.objects.filter(pk__in=stale_items).delete()
+        utils.bulk_update(changed_items, ['name', 'key', 'value_type', 'units', 'history', 'delay'])
+        models.Item.objects.bulk_create(new_items)
+
+    def _sync_templates_children(self, zabbix_templates, templates):
+        Through = models.Template.parents.through
+        nc_links = Through.objects.filter(
+            to_template__settings=self.settings,
+            to_template__backend_id__in=[t['templateid'] for t in zabbix_templates])
+        nc_links = {(link.from_template_id, link.to_template_id): link.pk for link in nc_links}
+
+        actual_links = set()
         for zabbix_template in zabbix_templates:
-            if not zabbix_template['templates']:
-                continue
-            nc_template = models.Template.objects.get(settings=self.settings, backend_id=zabbix_template['templateid'])
-            children_ids = [t['templateid'] for t in zabbix_template['templates']]
-            children = models.Template.objects.filter(settings=self.settings, backend_id__in=children_ids)
-            nc_template.children.add(*children)
-
-        logger.info('Successfully pulled Zabbix templates for settings %s', self.settings)
+            nc_template = templates[zabbix_template['templateid']]
+            for child in zabbix_template['templates']:
+                if child['templateid'] in templates:
+                    actual_links.add((templates[child['templateid']].pk, nc_template.pk))
+
+        stale_links = [pk for key, pk in nc_links.items() if key not in actual_links]
+        if stale_links:
+            Through.objects.filter(pk__in=stale_links).delete()
+        Through.objects.bulk_create([
+            Through(from_template_id=child_pk, to_template_id=parent_pk)
+            for child_pk, parent_pk in actual_links if (child_pk, parent_pk) not in nc_links
+        ])
 
     def get_item_last_value(self, host_id, key, **kwargs):
         try:
@@ -300,6 +709,22 @@ class ZabbixBackend(ServiceBackend):
         except IndexError:
             raise ZabbixBackendError('Cannot find item with key "%s" for host with id %s' % (key, host_id))
 
+    def get_items_last_values(self, hostids, keys):
+        """
+        Get last values of items with given keys of all given hosts with one request.
+        Output format: {<hostid>: {<item key>: <last value>}}
+        """
+        try:
+            items = self.api.item.get(
+                hostids=hostids, filter={'key_': keys}, output=['hostid', 'key_', 'lastvalue'])
+        except (pyzabbix.ZabbixAPIException, RequestException) as e:
+            raise ZabbixBackendError('Cannot get zabbix items. Exception: %s' % e)
+
+        values = {}
+        for item in items:
+            values.setdefault(item['hostid'], {})[item['key_']] = item['lastvalue']
+        return values
+
     # XXX: This method should be rewrited - we need to pull only IT services that were connected to hosts.
     def pull_itservices(self):
         """
@@ -478,7 +903,7 @@ class ZabbixBackend(ServiceBackend):
                 group_id = self.api.hostgroup.create({'name': group_name})['groupids'][0]
                 return group_id, True
             else:
-                return self.api.hostgroup.get(filter={'name': group_name})[0]['groupid'], False
+                return exists[0]['groupid'], False
         except (pyzabbix.ZabbixAPIException, IndexError, KeyError) as e:
             raise ZabbixBackendError('Cannot get or create group with name "%s". Exception: %s' % (group_name, e))
 
@@ -548,15 +973,37 @@ class ZabbixBackend(ServiceBackend):
             six.reraise(ZabbixBackendError, e)
 
     def get_sla(self, service_id, start_time, end_time):
+        return self.get_slas([service_id], [(start_time, end_time)])[service_id][0]
+
+    def get_slas(self, service_ids, intervals):
+        """
+        Get SLA values of several IT services for several intervals with one request.
+
+        Input: list of service IDs and list of (<start_time>, <end_time>) tuples.
+        Output format:
+            {
+                <service_id>: [<SLA for interval 1>, <SLA for interval 2>, ...],
+                ...
+            }
+        Services that are missing in Zabbix response are skipped.
+        """
+        if not service_ids:
+            return {}
         try:
             data = self.api.service.getsla(
-                filter={'serviceids': service_id},
-                intervals={'from': start_time, 'to': end_time}
+                serviceids=list(service_ids),
+                intervals=[{'from': start_time, 'to': end_time} for start_time, end_time in intervals]
             )
-            return data[service_id]['sla'][0]['sla']
+            slas = {service_id: [interval['sla'] for interval in data[service_id]['sla']]
+                    for service_id in service_ids if service_id in data}
         except (pyzabbix.ZabbixAPIException, RequestException, IndexError, KeyError) as e:
-            message = 'Can not get Zabbix IT service SLA value for service with ID %s. Exception: %s'
-            raise ZabbixBackendError(message % (service_id, e))
+            message = 'Can not get Zabbix IT service SLA value for services with IDs %s. Exception: %s'
+            raise ZabbixBackendError(message % (', '.join(service_ids), e))
+
+        missing_ids = [service_id for service_id in service_ids if service_id not in slas]
+        if missing_ids:
+            logger.warning('Zabbix did not return SLA values for IT services with IDs %s.', ', '.join(missing_ids))
+        return slas
 
     def get_itservice(self, service_id):
         try:
@@ -574,62 +1021,244 @@ class ZabbixBackend(ServiceBackend):
         Execute query to Zabbix DB to get minimum and maximum clock for service's alarm.
         Returns minimum and maximum dates.
         """
-        query = 'SELECT min(clock), max(clock) FROM service_alarms WHERE serviceid = %s'
-        cursor = self._execute_query(query, [serviceid])
+        query = 'SELECT min(clock), max(clock) FROM service_alarms WHERE serviceid = %(serviceid)s'
+        cursor = self._execute_query(query, {'serviceid': serviceid}, read_only=True)
         min_timestamp, max_timestamp = cursor.fetchone()
         return date.fromtimestamp(int(min_timestamp)), date.fromtimestamp(int(max_timestamp))
 
     def get_trigger_events(self, trigger_id, start_time, end_time):
+        return self.get_triggers_events([trigger_id], start_time, end_time).get(trigger_id, [])
+
+    def get_triggers_events(self, trigger_ids, start_time, end_time):
+        """
+        Get events of several triggers with one request.
+        Returns map <trigger_id> -> list of events sorted by time.
+        """
+        if not trigger_ids:
+            return {}
         try:
             event_data = self.api.event.get(
-                output='extend',
-                objectids=trigger_id,
+                output=['objectid', 'clock', 'value'],
+                objectids=list(trigger_ids),
                 time_from=start_time,
                 time_till=end_time,
                 sortfield=["clock"],
                 sortorder="ASC")
         except (pyzabbix.ZabbixAPIException, RequestException) as e:
-            message = 'Can not get events for trigger with ID %s. Exception: %s'
-            raise ZabbixBackendError(message % (trigger_id, e))
+            message = 'Can not get events for triggers with IDs %s. Exception: %s'
+            raise ZabbixBackendError(message % (', '.join(trigger_ids), e))
         else:
-            return [{'timestamp': e['clock'], 'value': e['value']} for e in event_data]
+            events = {}
+            for e in event_data:
+                events.setdefault(e['objectid'], []).append({'timestamp': e['clock'], 'value': e['value']})
+            return events
+
+    def reset_api(self):
+        """ Drop cached Zabbix API client, so next request will login with actual credentials """
+        api_pool.invalidate(self.settings)
+        if hasattr(self, '_api'):
+            del self._api
 
     def _get_api(self, backend_url, username, password):
         unsafe_session = QuietSession()
         unsafe_session.verify = False
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.API_CONNECTIONS_POOL_SIZE)
+        unsafe_session.mount('http://', adapter)
+        unsafe_session.mount('https://', adapter)
 
         api = pyzabbix.ZabbixAPI(server=backend_url, session=unsafe_session)
         api.login(username, password)
         return api
 
     def get_item_stats(self, hostid, item, points):
-        if item.value_type == models.Item.ValueTypes.FLOAT:
-            history_table = 'history'
-            trend_table = 'trends'
-        elif item.value_type == models.Item.ValueTypes.INTEGER:
-            # Integer value
-            history_table = 'history_uint'
-            trend_table = 'trends_uint'
-        else:
-            raise ZabbixBackendError('Cannot get statistics for non-numerical item %s' % item.key)
+        return self.get_items_stats([hostid], [item], points)[six.text_type(hostid)][item.key]
 
-        history_retention_days = item.history
-        history_delay_seconds = item.delay or self.HISTORY_DELAY_SECONDS
-        trend_delay_seconds = self.TREND_DELAY_SECONDS
+    def get_items_stats(self, hostids, items, points):
+        """
+        Get historical values of items for several hosts at once.
+        Values of all hosts and items are fetched with one query per history and trends table.
 
-        trends_start_date = datetime_to_timestamp(timezone.now() - timedelta(days=history_retention_days))
+        Values of intervals between points that have been closed for STATS_CACHE_DELAY_SECONDS
+        are cached for ITEMS_STATS_CACHE_TIMEOUT seconds. Only intervals starting with
+        the first one that is not cached are fetched from Zabbix DB.
 
+        Output format:
+            {
+                <hostid>: {
+                    <item1.key>: [<value>, <value>, ...],
+                    ...
+                },
+                ...
+            }
+        """
+        hostids = [six.text_type(hostid) for hostid in hostids]
+        cache_timeout = self._get_stats_cache_timeout()
+        closed_timestamp = self._get_stats_closed_timestamp()
+        closed_count = len([end for end in points[1:] if end <= closed_timestamp])
+        if (not cache_timeout or not closed_count or
+                len(hostids) * len(items) * closed_count > self.STATS_CACHE_MAX_KEYS):
+            return self._get_items_stats(hostids, items, points)
+
+        for item in items:
+            # Non-numeric items are not supported
+            self._get_history_tables(item.value_type)
+
+        cache_keys = {}
+        for hostid in hostids:
+            for item in items:
+                for index in range(closed_count):
+                    cache_keys[(hostid, item.key, index)] = self._get_stats_cache_key(
+                        'items_stats', hostid, item.key, item.delay, item.history, item.units,
+                        points[index], points[index + 1])
+        cached = cache.get_many(list(cache_keys.values()))
+        missing = [key[2] for key, cache_key in cache_keys.items() if cache_key not in cached]
+        first_missing = min(missing) if missing else closed_count
+
+        stats = {hostid: {} for hostid in hostids}
+        for hostid in hostids:
+            for item in items:
+                stats[hostid][item.key] = [
+                    cached[cache_keys[(hostid, item.key, index)]][0] for index in range(first_missing)]
+        if first_missing == len(points) - 1:
+            return stats
+
+        fetched_stats = self._get_items_stats(hostids, items, points[first_missing:])
+        new_values = {}
+        for hostid in hostids:
+            for item in items:
+                values = fetched_stats[hostid][item.key]
+                stats[hostid][item.key].extend(values)
+                for index in range(first_missing, closed_count):
+                    # Value is wrapped, so cached None can be distinguished from cache miss
+                    new_values[cache_keys[(hostid, item.key, index)]] = (values[index - first_missing],)
+        cache.set_many(new_values, cache_timeout)
+        return stats
+
+    def _get_items_stats(self, hostids, items, points):
+        stats = {hostid: {} for hostid in hostids}
         points = points[::-1]
-        history_cursor = self._get_history(
-            item.key, hostid, history_table, points[-1] - history_delay_seconds, points[0])
-        trends_cursor = self._get_history(
-            item.key, hostid, trend_table, points[-1] - trend_delay_seconds, points[0])
+
+        for value_type, type_items in self._group_items_by_value_type(items).items():
+            history_table, trend_table = self._get_history_tables(value_type)
+            item_ids = self._get_item_ids(hostids, [item.key for item in type_items])
+            type_items_by_key = {item.key: item for item in type_items}
+
+            # Trends are fetched at once before history is streamed, so only one pool connection is held
+            trends_start = points[-1] - self.TREND_DELAY_SECONDS
+            trends = ItemsHistoryReader(
+                self._iter_items_history(item_ids.values(), trend_table, trends_start, points[0], stream=False))
+            history_start = points[-1] - max(item.delay or self.HISTORY_DELAY_SECONDS for item in type_items)
+            history = ItemsHistoryReader(
+                self._iter_items_history(item_ids.values(), history_table, history_start, points[0]))
+
+            # Both history and trends are read in order of item IDs
+            items_by_id = {itemid: key for key, itemid in item_ids.items()}
+            try:
+                for itemid in sorted(items_by_id):
+                    hostid, key = items_by_id[itemid]
+                    item = type_items_by_key[key]
+                    item_history_start = points[-1] - (item.delay or self.HISTORY_DELAY_SECONDS)
+                    item_history_rows = (row for row in history.get(itemid) if row[0] > item_history_start)
+                    values = self._get_points_values(item, points, item_history_rows, trends.get(itemid))
+                    stats[hostid][item.key] = values[::-1]
+            finally:
+                history.close()
+                trends.close()
+
+            # Hosts without items do not have values
+            for hostid in hostids:
+                for item in type_items:
+                    stats[hostid].setdefault(item.key, [None] * (len(points) - 1))
+
+        return stats
+
+    def get_items_downsampled_stats(self, hostids, items, points, method='avg'):
+        """
+        Get historical values of items aggregated into buckets for several hosts at once.
+        Points should be evenly spaced, each point except the last one gets aggregated value
+        of the bucket that starts at this point, the same interval as in get_items_stats.
+        Aggregation is done by Zabbix DB, so only <points count> rows are read for each item.
+
+        Output format is the same as for get_items_stats method.
+        """
+        if method not in self.DOWNSAMPLING_METHODS:
+            raise ZabbixBackendError('Unknown downsampling method %s' % method)
+
+        hostids = [six.text_type(hostid) for hostid in hostids]
+        stats = {hostid: {} for hostid in hostids}
+        points_count = len(points)
+        step = max(int(round(float(points[-1] - points[0]) / max(points_count - 1, 1))), 1)
+        buckets_count = max(points_count - 1, 0)
+        # Do not read values that do not fall into the last bucket
+        end_timestamp = min(points[-1], points[0] + buckets_count * step)
+        now = timezone.now()
+
+        for value_type, type_items in self._group_items_by_value_type(items).items():
+            history_table, trend_table = self._get_history_tables(value_type)
+            item_ids = self._get_item_ids(hostids, [item.key for item in type_items])
+            trends_starts = {item.key: self._get_trends_start_timestamp(item, now) for item in type_items}
+
+            history_buckets = self._get_items_buckets(
+                item_ids.keys(), history_table, method, points[0], step, end_timestamp)
+            trends_buckets = {}
+            # Buckets that start before trends start are read from trends
+            trends_end_timestamp = min(end_timestamp, max(trends_starts.values()) + step)
+            if points[0] < trends_end_timestamp:
+                trends_buckets = self._get_items_buckets(
+                    item_ids.keys(), trend_table, method, points[0], step, trends_end_timestamp)
+
+            for hostid in hostids:
+                for item in type_items:
+                    itemid = item_ids.get((hostid, item.key))
+                    values = []
+                    for index in range(buckets_count):
+                        if points[0] + index * step > trends_starts[item.key]:
+                            value = history_buckets.get((itemid, index))
+                        else:
+                            value = trends_buckets.get((itemid, index))
+                        if value is not None and item.is_byte():
+                            value = self.b2mb(value)
+                        values.append(value)
+                    stats[hostid][item.key] = values
+
+        return stats
+
+    def _group_items_by_value_type(self, items):
+        items_by_value_type = {}
+        for item in items:
+            items_by_value_type.setdefault(item.value_type, []).append(item)
+        return items_by_value_type
+
+    def _get_history_tables(self, value_type):
+        if value_type == models.Item.ValueTypes.FLOAT:
+            return 'history', 'trends'
+        elif value_type == models.Item.ValueTypes.INTEGER:
+            # Integer value
+            return 'history_uint', 'trends_uint'
+        raise ZabbixBackendError('Cannot get statistics for non-numerical item with value type %s' % value_type)
+
+    def _get_trends_start_timestamp(self, item, now=None):
+        """ Items values older than history retention period are available only in trends tables """
+        now = now or timezone.now()
+        return datetime_to_timestamp(now - timedelta(days=item.history))
+
+    def _get_points_values(self, item, points, history_rows, trends_rows):
+        """
+        Match each interval between points with the closest preceding item value.
+        Points, history and trends rows are expected to be sorted by time in descending order.
+        Rows are read lazily, so streamed rows are not loaded into memory at once.
+        """
+        history_delay_seconds = item.delay or self.HISTORY_DELAY_SECONDS
+        trend_delay_seconds = self.TREND_DELAY_SECONDS
+        trends_start_date = self._get_trends_start_timestamp(item)
+        history_rows = iter(history_rows)
+        trends_rows = iter(trends_rows)
 
         values = []
         if points[0] > trends_start_date:
-            next_value = history_cursor.fetchone()
+            next_value = next(history_rows, None)
         else:
-            next_value = trends_cursor.fetchone()
+            next_value = next(trends_rows, None)
 
         for end, start in zip(points[:-1], points[1:]):
             if start > trends_start_date:
@@ -646,16 +1275,20 @@ class ZabbixBackend(ServiceBackend):
                     value = self.b2mb(value)
 
                 if time <= end:
-                    if end - time < interval or time > start:
-                        break
+                    if end - time >= interval and time <= start:
+                        # Closest value is too old - there is no data for this interval.
+                        value = None
+                    break
                 else:
+                    # Value is newer than interval end, it does not belong to this interval.
+                    value = None
                     if start > trends_start_date:
-                        next_value = history_cursor.fetchone()
+                        next_value = next(history_rows, None)
                     else:
-                        next_value = trends_cursor.fetchone()
+                        next_value = next(trends_rows, None)
 
             values.append(value)
-        return values[::-1]
+        return values
 
     def get_items_aggregated_values(self, host, items, start_timestamp, end_timestamp, method='MAX'):
         """
@@ -668,126 +1301,457 @@ class ZabbixBackend(ServiceBackend):
                 ...
             }
         """
-        int_items = [item for item in items if item.value_type == models.Item.ValueTypes.INTEGER]
-        float_items = [item for item in items if item.value_type == models.Item.ValueTypes.FLOAT]
+        hosts_values = self.get_hosts_items_aggregated_values(
+            [host.backend_id], items, start_timestamp, end_timestamp, method)
+        return hosts_values.get(host.backend_id, {})
 
-        # Get aggregated data from DB
-        db_data = tuple()
-        default_kwargs = {
-            'hostid': host.backend_id,
-            'start_timestamp': start_timestamp,
-            'end_timestamp': end_timestamp,
-            'method': method,
-        }
-        # XXX: We need to get values from table "trends" if end_timestamp < item.history.
-        if int_items:
-            cursor = self._get_aggregated_values(
-                item_keys=[item.key for item in int_items],
-                table='history_uint',
-                **default_kwargs
-            )
-            db_data += cursor.fetchall()
-        if float_items:
-            cursor = self._get_aggregated_values(
-                item_keys=[item.key for item in float_items],
-                table='history',
-                **default_kwargs
-            )
-            db_data += cursor.fetchall()
+    def get_hosts_items_aggregated_values(self, hostids, items, start_timestamp, end_timestamp, method='MAX'):
+        """
+        Get aggregate values of items of several hosts with one query per value table.
+
+        Values of hourly buckets that have been closed for STATS_CACHE_DELAY_SECONDS are cached
+        for ITEMS_STATS_CACHE_TIMEOUT seconds, so only buckets that are not cached and
+        parts of period that do not cover whole bucket are aggregated by Zabbix DB.
+
+        Output format:
+            {
+                <hostid>: {
+                    <item1.key>: <aggregated value>,
+                    ...
+                },
+                ...
+            }
+        """
+        numeric_types = (models.Item.ValueTypes.INTEGER, models.Item.ValueTypes.FLOAT)
+        items = [item for item in items if item.value_type in numeric_types]
+        hostids = [six.text_type(hostid) for hostid in hostids]
+        combine = self.AGGREGATION_COMBINERS[method]
+
+        bucket_size = self.STATS_CACHE_BUCKET_SECONDS
+        cache_timeout = self._get_stats_cache_timeout()
+        # Closed buckets that are covered by period completely
+        first_bucket = -(-start_timestamp // bucket_size)
+        last_bucket = (min(end_timestamp, self._get_stats_closed_timestamp()) + 1) // bucket_size
+        buckets_count = last_bucket - first_bucket
+        if (not cache_timeout or buckets_count <= 0 or
+                len(hostids) * len(items) * buckets_count > self.STATS_CACHE_MAX_KEYS):
+            periods_values = [self._aggregate_items_values(hostids, items, start_timestamp, end_timestamp, method)]
+        else:
+            periods_values = [self._get_cached_aggregated_buckets(
+                hostids, items, first_bucket, last_bucket, method, cache_timeout)]
+            if start_timestamp < first_bucket * bucket_size:
+                periods_values.append(self._aggregate_items_values(
+                    hostids, items, start_timestamp, first_bucket * bucket_size - 1, method))
+            if end_timestamp >= last_bucket * bucket_size:
+                periods_values.append(self._aggregate_items_values(
+                    hostids, items, last_bucket * bucket_size, end_timestamp, method))
+
+        aggregated_values = {}
+        for values in periods_values:
+            for (hostid, key, _), value in values.items():
+                if value is None:
+                    continue
+                host_values = aggregated_values.setdefault(hostid, {})
+                host_values[key] = combine(host_values[key], value) if key in host_values else value
 
         # Prepare data - convert B to MB if needed
         items_keys = {item.key: item for item in items}
-        aggregated_values = {}
-        for key, value in db_data:
-            item = items_keys[key]
-            aggregated_values[key] = self.b2mb(value) if item.is_byte() else value
+        for host_values in aggregated_values.values():
+            for key, value in host_values.items():
+                if items_keys[key].is_byte():
+                    host_values[key] = self.b2mb(value)
         return aggregated_values
 
+    def _aggregate_items_values(self, hostids, items, start_timestamp, end_timestamp, method, bucket_size=None):
+        """
+        Aggregate values of items with one query per value table.
+        If bucket_size is given, values are aggregated into buckets of <bucket_size> seconds,
+        bucket with index N contains values from interval [N * <bucket_size>, (N + 1) * <bucket_size>).
+        Returns map (<hostid>, <item key>, <bucket index or None>) -> <aggregated value>.
+        """
+        combine = self.AGGREGATION_COMBINERS[method]
+        now = timezone.now()
+
+        # Items with the same value type and history retention period are aggregated together
+        items_groups = {}
+        for item in items:
+            items_groups.setdefault((item.value_type, item.history), []).append(item)
+
+        values = {}
+        for (value_type, _), group_items in items_groups.items():
+            history_table, trends_table = self._get_history_tables(value_type)
+            trends_start = self._get_trends_start_timestamp(group_items[0], now)
+            item_keys = [item.key for item in group_items]
+
+            periods = []
+            # Values older than history retention period are available only in trends
+            if start_timestamp < trends_start:
+                periods.append((trends_table, start_timestamp, min(end_timestamp, trends_start - 1)))
+            if end_timestamp >= trends_start:
+                periods.append((history_table, max(start_timestamp, trends_start), end_timestamp))
+
+            for table, period_start, period_end in periods:
+                if bucket_size:
+                    rows = self._get_aggregated_buckets(
+                        hostids, item_keys, period_start, period_end, table, method, bucket_size)
+                else:
+                    rows = [(hostid, key, None, value) for hostid, key, value in self._get_aggregated_values(
+                        hostids, item_keys, period_start, period_end, table, method)]
+
+                for hostid, key, bucket, value in rows:
+                    if value is None:
+                        continue
+                    values_key = (six.text_type(hostid), key, bucket)
+                    # Trends and history values of the same item are combined
+                    values[values_key] = combine(values[values_key], value) if values_key in values else value
+        return values
+
+    def _get_cached_aggregated_buckets(self, hostids, items, first_bucket, last_bucket, method, cache_timeout):
+        """
+        Get aggregated values of closed buckets from first_bucket to last_bucket exclusive.
+        Buckets that are not cached are aggregated by Zabbix DB and cached.
+        """
+        cache_keys = {}
+        for hostid in hostids:
+            for item in items:
+                for bucket in range(first_bucket, last_bucket):
+                    cache_keys[(hostid, item.key, bucket)] = self._get_stats_cache_key(
+                        'aggregated_values', hostid, item.key, item.history, method, bucket)
+        cached = cache.get_many(list(cache_keys.values()))
+        values = {key: cached[cache_key][0] for key, cache_key in cache_keys.items() if cache_key in cached}
+        missing_buckets = [key[2] for key in cache_keys if key not in values]
+        if not missing_buckets:
+            return values
+
+        first_missing, last_missing = min(missing_buckets), max(missing_buckets)
+        bucket_size = self.STATS_CACHE_BUCKET_SECONDS
+        fetched_values = self._aggregate_items_values(
+            hostids, items, first_missing * bucket_size, (last_missing + 1) * bucket_size - 1, method, bucket_size)
+        new_values = {}
+        for key, cache_key in cache_keys.items():
+            if first_missing <= key[2] <= last_missing:
+                values[key] = fetched_values.get(key)
+                # Value is wrapped, so cached None can be distinguished from cache miss
+                new_values[cache_key] = (values[key],)
+        cache.set_many(new_values, cache_timeout)
+        return values
+
+    def _get_stats_cache_timeout(self):
+        return getattr(django_settings, 'WALDUR_ZABBIX', {}).get('ITEMS_STATS_CACHE_TIMEOUT', 0)
+
+    def _get_stats_closed_timestamp(self):
+        """ Item values older than returned timestamp are not changed anymore """
+        return datetime_to_timestamp(timezone.now()) - self.STATS_CACHE_DELAY_SECONDS
+
+    def _get_stats_cache_key(self, name, *parts):
+        parts = json.dumps(parts, default=six.text_type)
+        return 'waldur_zabbix:%s:%s:%s' % (
+            name, self.settings.uuid.hex, hashlib.sha1(parts.encode('utf-8')).hexdigest())
+
     def b2mb(self, value):
         return value / 1024 / 1024
 
-    def _get_history(self, item_key, hostid, table, start_timestamp, end_timestamp):
+    def _get_item_ids(self, hostids, item_keys):
         """
-        Execute query to zabbix db to get item values from history
+        Execute query to zabbix DB to get IDs of hosts items.
+        Returns map (<hostid>, <item key>) -> <itemid>.
         """
         query = (
-            'SELECT clock time, %(value_path)s value '
-            'FROM %(table)s history, items '
-            'WHERE history.itemid = items.itemid '
-            'AND items.key_ = "%(item_key)s" '
-            'AND items.hostid = %(hostid)s '
+            'SELECT itemid, hostid, key_ '
+            'FROM items '
+            'WHERE hostid IN %(hostids)s '
+            'AND key_ IN %(item_keys)s'
+        )
+        parameters = {
+            'hostids': list(hostids),
+            'item_keys': list(item_keys),
+        }
+        cursor = self._execute_query(query, parameters, read_only=True)
+        return {(six.text_type(hostid), key): itemid for itemid, hostid, key in cursor.fetchall()}
+
+    def _iter_items_history(self, item_ids, table, start_timestamp, end_timestamp, stream=True):
+        """
+        Execute query to zabbix DB to get values of several items from history.
+        Rows are read lazily with unbuffered cursor, if stream is False they are fetched at once.
+        Yields (<itemid>, <iterator of (<time>, <value>)>) pairs sorted by item ID,
+        values of each item are sorted by time in descending order.
+        """
+        if not item_ids:
+            return iter([])
+
+        query = (
+            'SELECT itemid, clock time, {value_path} value '
+            'FROM {table} '
+            'WHERE itemid IN %(item_ids)s '
             'AND clock > %(start_timestamp)s '
             'AND clock < %(end_timestamp)s '
-            'ORDER BY clock DESC'
-        )
+            'ORDER BY itemid, clock DESC'
+        ).format(table=table, value_path=table.startswith('history') and 'value' or 'value_avg')
         parameters = {
-            'table': table,
-            'item_key': item_key,
-            'hostid': hostid,
+            'item_ids': list(item_ids),
             'start_timestamp': start_timestamp,
             'end_timestamp': end_timestamp,
-            'value_path': table.startswith('history') and 'value' or 'value_avg'
         }
-        query = query % parameters
 
-        return self._execute_query(query)
+        rows = self._execute_query(query, parameters, read_only=True, stream=stream)
+        return ((itemid, ((time, value) for _, time, value in item_rows))
+                for itemid, item_rows in itertools.groupby(rows, key=operator.itemgetter(0)))
 
-    def _get_aggregated_values(self, hostid, item_keys, start_timestamp, end_timestamp, table, method='MAX'):
+    def _get_items_buckets(self, item_ids, table, method, first_point, step, end_timestamp):
         """
-        Execute query to zabbix DB to get item aggregated historical value.
+        Execute query to zabbix DB to get values of several items aggregated into buckets of <step> seconds.
+        Bucket with index N contains values from interval
+        (<first_point> + N * <step>, <first_point> + (N + 1) * <step>].
+        Returns map (<itemid>, <bucket index>) -> <aggregated value>.
+        """
+        if not item_ids:
+            return {}
+
+        if table.startswith('history'):
+            value_path = self.DOWNSAMPLING_METHODS[method] % {'column': 'value'}
+        else:
+            column = {'min': 'value_min', 'max': 'value_max'}.get(method, 'value_avg')
+            value_path = self.DOWNSAMPLING_METHODS[method] % {'column': column}
+
+        bucket_path = '(clock - %(first_point)s - 1) DIV %(step)s'
+        if method == 'last':
+            # Value of the latest row is selected by its time, so it is not converted to string
+            query = (
+                'SELECT history.itemid, (history.clock - %(first_point)s - 1) DIV %(step)s bucket, '
+                'history.{value_path} value '
+                'FROM {table} history, ('
+                'SELECT itemid, MAX(clock) clock '
+                'FROM {table} '
+                'WHERE itemid IN %(item_ids)s '
+                'AND clock > %(start_timestamp)s '
+                'AND clock <= %(end_timestamp)s '
+                'GROUP BY itemid, {bucket_path}'
+                ') latest '
+                'WHERE history.itemid = latest.itemid AND history.clock = latest.clock'
+            ).format(table=table, value_path=value_path, bucket_path=bucket_path)
+        else:
+            query = (
+                'SELECT itemid, {bucket_path} bucket, {value_path} value '
+                'FROM {table} '
+                'WHERE itemid IN %(item_ids)s '
+                'AND clock > %(start_timestamp)s '
+                'AND clock <= %(end_timestamp)s '
+                'GROUP BY itemid, bucket'
+            ).format(table=table, value_path=value_path, bucket_path=bucket_path)
+        parameters = {
+            'item_ids': list(item_ids),
+            'first_point': first_point,
+            'step': step,
+            'start_timestamp': first_point,
+            'end_timestamp': end_timestamp,
+        }
+
+        buckets = {}
+        for itemid, bucket, value in self._execute_query(query, parameters, read_only=True).fetchall():
+            buckets[(itemid, int(bucket))] = value
+        return buckets
+
+    def _get_aggregated_values(self, hostids, item_keys, start_timestamp, end_timestamp, table, method='MAX'):
         """
+        Execute query to zabbix DB to get items aggregated historical values of several hosts.
+        Trends tables store hourly minimum and maximum, they are aggregated instead of value.
+        """
+        if method not in self.AGGREGATION_COMBINERS:
+            raise ZabbixBackendError('Unknown aggregation method %s' % method)
+        if table.startswith('history'):
+            column = 'value'
+        else:
+            column = {'MIN': 'value_min', 'MAX': 'value_max'}[method]
+
         # XXX: This query is really slow with a lot of item_keys, need to speed up it with index.
         query = (
-            'SELECT items.key_, %(method)s(value) '
-            'FROM hosts, items, %(table)s history '
-            'WHERE items.hostid = %(hostid)s AND hosts.hostid = %(hostid)s AND history.itemid = items.itemid '
-            'AND items.key_ IN (%(item_keys)s) '
+            'SELECT items.hostid, items.key_, {method}({column}) '
+            'FROM items, {table} history '
+            'WHERE items.hostid IN %(hostids)s AND history.itemid = items.itemid '
+            'AND items.key_ IN %(item_keys)s '
             'AND clock >= %(start_timestamp)s '
             'AND clock <= %(end_timestamp)s '
-            'GROUP BY items.key_'
-        )
+            'GROUP BY items.hostid, items.key_'
+        ).format(method=method, column=column, table=table)
+        parameters = {
+            'hostids': list(hostids),
+            'item_keys': list(item_keys),
+            'start_timestamp': start_timestamp,
+            'end_timestamp': end_timestamp,
+        }
+        return self._execute_query(query, parameters, read_only=True)
 
+    def _get_aggregated_buckets(self, hostids, item_keys, start_timestamp, end_timestamp, table, method,
+                                bucket_size):
+        """
+        Execute query to zabbix DB to get items historical values of several hosts
+        aggregated into buckets of <bucket_size> seconds.
+        """
+        if method not in self.AGGREGATION_COMBINERS:
+            raise ZabbixBackendError('Unknown aggregation method %s' % method)
+        if table.startswith('history'):
+            column = 'value'
+        else:
+            column = {'MIN': 'value_min', 'MAX': 'value_max'}[method]
+
+        query = (
+            'SELECT items.hostid, items.key_, clock DIV %(bucket_size)s bucket, {method}({column}) '
+            'FROM items, {table} history '
+            'WHERE items.hostid IN %(hostids)s AND history.itemid = items.itemid '
+            'AND items.key_ IN %(item_keys)s '
+            'AND clock >= %(start_timestamp)s '
+            'AND clock <= %(end_timestamp)s '
+            'GROUP BY items.hostid, items.key_, bucket'
+        ).format(method=method, column=column, table=table)
         parameters = {
-            'method': method,
-            'table': table,
-            'hostid': hostid,
-            'item_keys': ', '.join(['"%s"' % key for key in item_keys]),
+            'hostids': list(hostids),
+            'item_keys': list(item_keys),
             'start_timestamp': start_timestamp,
             'end_timestamp': end_timestamp,
+            'bucket_size': bucket_size,
         }
+        return [(hostid, key, int(bucket), value)
+                for hostid, key, bucket, value in self._execute_query(query, parameters, read_only=True)]
+
+    def _get_db_pool(self, parameters=None, server='primary'):
+        parameters = parameters or self.database_parameters
+        connection_parameters = {name: parameters[name] for name in ('host', 'port', 'name', 'user', 'password')}
+        return db_pools.get(
+            self.settings,
+            connection_parameters,
+            server=server,
+            max_size=int(parameters.get('pool_size', self.DB_POOL_SIZE)),
+            idle_timeout=int(parameters.get('pool_idle_timeout', self.DB_POOL_IDLE_TIMEOUT)),
+            wait_timeout=int(parameters.get('pool_wait_timeout', self.DB_POOL_WAIT_TIMEOUT)),
+        )
 
-        query = query % parameters
-        return self._execute_query(query)
-
-    def _get_db_connection(self, force=False):
-        host = self.database_parameters['host']
-        port = self.database_parameters['port']
-        name = self.database_parameters['name']
-        user = self.database_parameters['user']
-        password = self.database_parameters['password']
-
-        key = '/'.join([name, host, port])
-        if key not in connections.databases or force:
-            connections.databases[key] = {
-                'ENGINE': 'django.db.backends.mysql',
-                'NAME': name,
-                'HOST': host,
-                'PORT': port,
-                'USER': user,
-                'PASSWORD': password
-            }
-        return connections[key]
+    def _get_replica_pool(self):
+        """
+        Choose healthy read replica according to replicas weights.
+        Replica parameters that are not defined are taken from primary database parameters.
+        Returns None if there are no healthy replicas.
+        """
+        parameters = self.database_parameters
+        max_lag = int(parameters.get('max_replication_lag', self.DB_MAX_REPLICATION_LAG))
+        candidates = []
+        for replica in parameters.get('replicas') or []:
+            replica_parameters = dict(parameters, **replica)
+            server = '%s:%s' % (replica_parameters['host'], replica_parameters['port'])
+            pool = self._get_db_pool(replica_parameters, server=server)
+            weight = float(replica.get('weight', 1))
+            if weight > 0 and replica_monitor.is_healthy(pool, max_lag):
+                candidates.append((weight, pool))
+
+        if not candidates:
+            return None
+        choice = random.uniform(0, sum(weight for weight, _ in candidates))  # nosec
+        for weight, pool in candidates:
+            choice -= weight
+            if choice <= 0:
+                return pool
+        return candidates[-1][1]
+
+    def reset_db_pool(self):
+        db_pools.invalidate(self.settings)
+
+    def _execute_query(self, query, parameters=None, read_only=False, stream=False):
+        """
+        Execute query to Zabbix DB with bound parameters.
+        List parameters are expanded for IN clauses, e.g. 'WHERE itemid IN %(item_ids)s'.
+        Connection is taken from the pool of the Zabbix DB and returned right after rows are fetched.
+        Read-only queries are executed by read replica if there is a healthy one,
+        primary database is used if replica fails.
+        If stream is True, generator of rows is returned. Rows are fetched lazily by chunks
+        and connection is held until all rows are read. Streamed queries are not repeated on primary.
+        Queries that exceed query_timeout raise ZabbixQueryTimeoutError and are not repeated either.
+        """
+        query, parameters = self._prepare_query(query, parameters or {})
+        query = self._add_execution_time_hint(query)
+        if stream:
+            pool = (self._get_replica_pool() if read_only else None) or self._get_db_pool()
+            return self._stream_prepared_query(pool, query, parameters)
+        if read_only:
+            pool = self._get_replica_pool()
+            if pool is not None:
+                try:
+                    return self._execute_prepared_query(pool, query, parameters)
+                except ZabbixQueryTimeoutError:
+                    raise
+                except ZabbixBackendError:
+                    logger.warning('Query to Zabbix DB replica %s failed, primary database is used.',
+                                   pool.parameters['host'])
+                    replica_monitor.mark_unhealthy(pool)
+        return self._execute_prepared_query(self._get_db_pool(), query, parameters)
+
+    def _execute_prepared_query(self, pool, query, parameters):
+        logger.debug('Executing query %s to Zabbix', query)
+        start = time.time()
+        try:
+            with pool.connection(self.query_timeout) as connection:
+                cursor = connection.cursor()
+                try:
+                    cursor.execute(query, parameters)
+                    result = ZabbixQueryResult(cursor.fetchall())
+                finally:
+                    cursor.close()
+        except QueryTimeoutError as e:
+            logger.warning('Query %s to Zabbix has been interrupted. Error: %s', query, e)
+            six.reraise(ZabbixQueryTimeoutError, e, sys.exc_info()[2])
+        except DatabaseError as e:
+            logger.exception('Can not execute query the Zabbix DB.')
+            six.reraise(ZabbixBackendError, e, sys.exc_info()[2])
 
-    def _execute_query(self, query, *args, **kwargs):
-        logger.debug('Executing query %s to Zabbix' % query)
+        self._record_query_duration(query, time.time() - start)
+        return result
+
+    def _stream_prepared_query(self, pool, query, parameters):
+        logger.debug('Streaming query %s to Zabbix', query)
+        start = time.time()
         try:
-            cursor = self._get_db_connection().cursor()
-            cursor.execute(query, *args, **kwargs)
-            return cursor
+            for row in pool.stream(query, parameters, self.DB_STREAM_CHUNK_SIZE, self.query_timeout):
+                yield row
+        except QueryTimeoutError as e:
+            logger.warning('Query %s to Zabbix has been interrupted. Error: %s', query, e)
+            six.reraise(ZabbixQueryTimeoutError, e, sys.exc_info()[2])
         except DatabaseError as e:
             logger.exception('Can not execute query the Zabbix DB.')
             six.reraise(ZabbixBackendError, e, sys.exc_info()[2])
 
+        self._record_query_duration(query, time.time() - start)
+
+    def _add_execution_time_hint(self, query):
+        """
+        Ask server to interrupt SELECT query if it exceeds query_timeout.
+        Servers that do not support MAX_EXECUTION_TIME hint treat it as comment,
+        their queries are killed by connection pool.
+        """
+        if not self.query_timeout or not query.lstrip().upper().startswith('SELECT'):
+            return query
+        milliseconds = int(self.query_timeout * 1000)
+        return 'SELECT /*+ MAX_EXECUTION_TIME(%d) */' % milliseconds + query.lstrip()[len('SELECT'):]
+
+    def _record_query_duration(self, query, duration):
+        self.query_durations.append((query, duration))
+        if duration > self.SLOW_QUERY_SECONDS:
+            logger.warning('Query %s to Zabbix took %.3f seconds', query, duration)
+        else:
+            logger.debug('Query %s to Zabbix took %.3f seconds', query, duration)
+
+    def _prepare_query(self, query, parameters):
+        """ Expand list parameters into separate placeholders """
+        prepared_query = query
+        bound_parameters = {}
+        for name, value in parameters.items():
+            if isinstance(value, (list, tuple, set)):
+                value = list(value) or [None]
+                placeholders = ', '.join('%%(%s_%s)s' % (name, index) for index in range(len(value)))
+                prepared_query = prepared_query.replace('%%(%s)s' % name, '(%s)' % placeholders)
+                for index, element in enumerate(value):
+                    bound_parameters['%s_%s' % (name, index)] = element
+            else:
+                bound_parameters[name] = value
+        return prepared_query, bound_parameters
+
     def import_host(self, host_backend_id, service_project_link=None, save=True):
         if save and not service_project_link:
             raise AttributeError('Cannot save imported host if SPL is not defined.')
@@ -800,25 +1764,29 @@ class ZabbixBackend(ServiceBackend):
         except (pyzabbix.ZabbixAPIException, RequestException) as e:
             six.reraise(ZabbixBackendError, e)
 
+        host = self._backend_host_to_host(backend_host)
+        host.backend_id = host_backend_id
+
+        if save:
+            host.service_project_link = service_project_link
+            host.save()
+            templates = self.get_host_templates(host)
+            host.templates.add(*templates)
+        return host
+
+    def _backend_host_to_host(self, backend_host):
         host = models.Host()
         host.name = backend_host['host']
         host.visible_name = backend_host['name']
         host.description = backend_host['description']
         host.error = backend_host['error']
         host.status = backend_host['status']
-        host.backend_id = host_backend_id
         if backend_host.get('groups'):
             # Host groups list is serialized as in following example:
             # [{u'internal': u'0', u'flags': u'0', u'groupid': u'15', u'name': u'waldur'}]
             host.host_group_name = backend_host['groups'][0]['name']
         else:
             host.host_group_name = ''
-
-        if save:
-            host.service_project_link = service_project_link
-            host.save()
-            templates = self.get_host_templates(host)
-            host.templates.add(*templates)
         return host
 
     def get_host_templates(self, host):
@@ -845,6 +1813,77 @@ class ZabbixBackend(ServiceBackend):
         host.templates.remove(*(host_templates - imported_host_templates))
         host.templates.add(*(imported_host_templates - host_templates))
 
+    def pull_hosts(self, hosts):
+        """
+        Pull given hosts of service settings and their templates with one host.get request.
+        Hosts that are gone from backend are marked as erred, erred hosts that are found are recovered.
+        """
+        hosts = [host for host in hosts if host.backend_id]
+        if not hosts:
+            return
+
+        import_time = timezone.now()
+        try:
+            backend_hosts = self.api.host.get(
+                hostids=[host.backend_id for host in hosts],
+                selectGroups=['name'],
+                selectParentTemplates=['templateid'],
+                output=['hostid', 'host', 'name', 'description', 'error', 'status'])
+        except (pyzabbix.ZabbixAPIException, RequestException) as e:
+            six.reraise(ZabbixBackendError, e)
+        backend_hosts = {backend_host['hostid']: backend_host for backend_host in backend_hosts}
+
+        update_fields = ('name', 'visible_name', 'description', 'error', 'status', 'host_group_name')
+        # Hosts that were modified locally during import are not overridden, as in pull_host
+        hosts_modified = dict(models.Host.objects.filter(pk__in=[host.pk for host in hosts])
+                              .values_list('pk', 'modified'))
+        templates = dict(models.Template.objects.filter(settings=self.settings).values_list('backend_id', 'pk'))
+        HostTemplate = models.Host.templates.through
+        host_templates = {(host_id, template_id): pk for pk, host_id, template_id in
+                          HostTemplate.objects.filter(host__in=hosts).values_list('pk', 'host_id', 'template_id')}
+
+        changed_hosts = []
+        imported_host_templates = set()
+        for host in hosts:
+            backend_host = backend_hosts.get(host.backend_id)
+            if backend_host is None:
+                if host.state != models.Host.States.ERRED:
+                    host.set_erred()
+                host.error_message = 'Host with id %s does not exist at backend' % host.backend_id
+                host.save(update_fields=['state', 'error_message'])
+                continue
+
+            if host.state == models.Host.States.ERRED:
+                host.recover()
+                host.error_message = ''
+                host.save(update_fields=['state', 'error_message'])
+
+            imported_host = self._backend_host_to_host(backend_host)
+            modified = hosts_modified.get(host.pk)
+            if modified is not None and modified < import_time:
+                changed_fields = [field for field in update_fields
+                                  if getattr(host, field) != getattr(imported_host, field)]
+                if changed_fields:
+                    for field in changed_fields:
+                        setattr(host, field, getattr(imported_host, field))
+                    changed_hosts.append(host)
+
+            for backend_template in backend_host.get('parentTemplates', []):
+                if backend_template['templateid'] in templates:
+                    imported_host_templates.add((host.pk, templates[backend_template['templateid']]))
+
+        with transaction.atomic():
+            utils.bulk_update(changed_hosts, update_fields)
+
+            stale_links = [pk for key, pk in host_templates.items() if key not in imported_host_templates]
+            if stale_links:
+                HostTemplate.objects.filter(pk__in=stale_links).delete()
+
+            HostTemplate.objects.bulk_create([
+                HostTemplate(host_id=host_id, template_id=template_id)
+                for host_id, template_id in imported_host_templates if (host_id, template_id) not in host_templates
+            ])
+
     def get_trigger_request(self, query):
         request = {}
 
@@ -890,69 +1929,141 @@ class ZabbixBackend(ServiceBackend):
 
         return request
 
-    def get_trigger_status(self, query):
+    def _get_trigger_cache_key(self, method, query, **kwargs):
         request = self.get_trigger_request(query)
-        get_events_count = query.get('include_events_count')
-        get_trigger_hosts = query.get('include_trigger_hosts')
-        try:
-            backend_triggers = self.api.trigger.get(**request)
-
-            backend_events = None
-            if get_events_count:
-                objectids = map(lambda t: t['triggerid'], backend_triggers)
-                backend_events = self.api.event.get(objectids=objectids,
-                                                    acknowledged=0,
-                                                    countOutput=True,
-                                                    groupCount=True,
-                                                    value='1')  # 1 means that trigger has a problem
-                # https://www.zabbix.com/documentation/3.4/manual/api/reference/event/object
-
-            trigger_hosts = None
-            if get_trigger_hosts:
-                objectids = map(lambda t: t['triggerid'], backend_triggers)
-                trigger_hosts = self.api.host.get(triggerids=objectids)
-
-            triggers = []
+        request['include_events_count'] = bool(query.get('include_events_count'))
+        request['include_trigger_hosts'] = bool(query.get('include_trigger_hosts'))
+        request.update(kwargs)
+        request = json.dumps(request, sort_keys=True, default=six.text_type)
+        return 'waldur_zabbix:%s:%s:%s' % (
+            method, self.settings.uuid.hex, hashlib.sha1(request.encode('utf-8')).hexdigest())
+
+    def _get_cached_trigger_response(self, method, query, func, **kwargs):
+        timeout = django_settings.WALDUR_ZABBIX.get('TRIGGER_STATUS_CACHE_TIMEOUT', 0)
+        key = self._get_trigger_cache_key(method, query, **kwargs)
+        return response_cache.get(key, timeout, lambda: func(query, **kwargs))
+
+    def get_trigger_status(self, query, offset=None, limit=None):
+        """
+        Get triggers that match query ordered by last change.
+        If limit is given, only triggers of requested page are fetched.
+        Events count and hosts are fetched only for these triggers too.
+        """
+        return self._get_cached_trigger_response(
+            'trigger_status', query, self._get_trigger_status, offset=offset, limit=limit)
 
-            for trigger in backend_triggers:
-                triggers.append(self._parse_trigger(trigger, backend_events, trigger_hosts))
+    def _get_trigger_status(self, query, offset=None, limit=None):
+        request = self.get_trigger_request(query)
+        try:
+            if limit is None:
+                backend_triggers = self.api.trigger.get(**dict(request, **self.TRIGGERS_ORDERING))
+            else:
+                backend_triggers = self._get_triggers_page(request, offset or 0, limit)
+            return self._parse_triggers(backend_triggers, query)
+        except (pyzabbix.ZabbixAPIException, RequestException) as e:
+            logger.exception('Unable to fetch Zabbix triggers')
+            six.reraise(ZabbixBackendError, e)
 
-            return triggers
+    def iter_trigger_status(self, query, chunk_size=500):
+        """
+        Yield triggers that match query ordered by last change without loading all of them in memory.
+        IDs of all triggers are fetched first, details are fetched by chunks.
+        """
+        request = self.get_trigger_request(query)
+        try:
+            backend_triggers = self.api.trigger.get(output=['triggerid'], **self._get_trigger_ids_request(request))
+            triggerids = [trigger['triggerid'] for trigger in backend_triggers]
+            for index in range(0, len(triggerids), chunk_size):
+                backend_triggers = self._get_triggers_by_ids(request, triggerids[index:index + chunk_size])
+                for trigger in self._parse_triggers(backend_triggers, query):
+                    yield trigger
         except (pyzabbix.ZabbixAPIException, RequestException) as e:
             logger.exception('Unable to fetch Zabbix triggers')
             six.reraise(ZabbixBackendError, e)
 
-    def _parse_trigger(self, backend_trigger, backend_events=None, trigger_hosts=None):
+    def _get_trigger_ids_request(self, request):
+        """ Hosts and expanded texts are not needed if only trigger IDs are fetched. """
+        request = {key: value for key, value in request.items()
+                   if key not in ('selectHosts', 'expandComment', 'expandDescription', 'expandExpression')}
+        request.update(self.TRIGGERS_ORDERING)
+        return request
+
+    def _get_triggers_by_ids(self, request, triggerids):
+        """ Fetch details of triggers and keep order of given IDs """
+        backend_triggers = self.api.trigger.get(triggerids=triggerids, **request)
+        positions = {triggerid: position for position, triggerid in enumerate(triggerids)}
+        return sorted(backend_triggers, key=lambda trigger: positions[trigger['triggerid']])
+
+    def _get_triggers_page(self, request, offset, limit):
+        """
+        Zabbix API does not support offset, so IDs of triggers up to the end of page
+        are fetched first and details are fetched only for triggers of the page.
+        """
+        if limit <= 0:
+            return []
+
+        backend_triggers = self.api.trigger.get(
+            output=['triggerid'], limit=offset + limit, **self._get_trigger_ids_request(request))
+        triggerids = [trigger['triggerid'] for trigger in backend_triggers[offset:offset + limit]]
+        if not triggerids:
+            return []
+        return self._get_triggers_by_ids(request, triggerids)
+
+    def _parse_triggers(self, backend_triggers, query):
+        objectids = [t['triggerid'] for t in backend_triggers]
+
+        # Events and hosts are fetched in one HTTP request
+        with self.batch() as batch:
+            events_call = hosts_call = None
+            if query.get('include_events_count'):
+                events_call = batch.call('event.get',
+                                         objectids=objectids,
+                                         acknowledged=0,
+                                         countOutput=True,
+                                         groupCount=True,
+                                         value='1')  # 1 means that trigger has a problem
+                # https://www.zabbix.com/documentation/3.4/manual/api/reference/event/object
+
+            if query.get('include_trigger_hosts'):
+                hosts_call = batch.call('host.get', triggerids=objectids)
+
+        events_counts = hosts_names = None
+        if events_call:
+            events_counts = {event['objectid']: event['rowscount'] for event in events_call.result}
+        if hosts_call:
+            hosts_names = {host['hostid']: host['host'] for host in hosts_call.result}
+
+        fields = django_settings.WALDUR_ZABBIX['TRIGGER_FIELDS']
+        return [self._parse_trigger(trigger, fields, events_counts, hosts_names) for trigger in backend_triggers]
+
+    def _parse_trigger(self, backend_trigger, fields, events_counts=None, hosts_names=None):
+        """
+        Convert backend trigger to response dict.
+        Events counts and hosts names are given as dicts indexed by trigger ID and host ID respectively.
+        """
         trigger = {}
 
-        for field in django_settings.WALDUR_ZABBIX['TRIGGER_FIELDS']:
+        for field in fields:
             trigger[field[0]] = backend_trigger[field[1]]
 
         trigger['changed'] = timestamp_to_datetime(backend_trigger['lastchange'])
-        trigger['hosts'] = []
-
-        for host in backend_trigger['hosts']:
-            host_id = host['hostid']
 
-            if trigger_hosts is not None:
-                host_name = filter(lambda h: h['hostid'] == host_id, trigger_hosts)
-                if host_name:
-                    host_name = host_name[0]['host']
-                else:
-                    host_name = ''
-            else:
-                host_name = None
-
-            trigger['hosts'].append({'id': host_id, 'name': host_name})
+        if hosts_names is not None:
+            trigger['hosts'] = [{'id': host['hostid'], 'name': hosts_names.get(host['hostid'], '')}
+                                for host in backend_trigger['hosts']]
+        else:
+            trigger['hosts'] = [{'id': host['hostid'], 'name': None} for host in backend_trigger['hosts']]
 
         trigger['event_count'] = None
-        if backend_events is not None:
-            events = filter(lambda e: e['objectid'] == trigger['backend_id'], backend_events)
-            trigger['event_count'] = 0 if not events else events[0]['rowscount']
+        if events_counts is not None:
+            trigger['event_count'] = events_counts.get(trigger['backend_id'], 0)
 
         return trigger
 
     def get_trigger_count(self, query):
+        return self._get_cached_trigger_response('trigger_count', query, self._get_trigger_count)
+
+    def _get_trigger_count(self, query):
         request = self.get_trigger_request(query)
         try:
             return int(self.api.trigger.get(countOutput=True, **request))
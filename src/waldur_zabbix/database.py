@@ -0,0 +1,422 @@
+import heapq
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from django.db import DatabaseError
+from django.utils import six
+
+
+logger = logging.getLogger(__name__)
+
+# Errors that are raised by server if query exceeds MAX_EXECUTION_TIME (MySQL) or max_statement_time (MariaDB)
+QUERY_TIMEOUT_ERROR_CODES = (3024, 1969)
+
+
+class QueryTimeoutError(DatabaseError):
+    pass
+
+
+class ZabbixDBConnectionPool(object):
+    """
+    Bounded pool of connections to Zabbix MySQL database.
+
+    At most max_size connections are opened, callers wait for a free connection
+    up to wait_timeout seconds. Connections that have been idle longer than
+    idle_timeout are closed, connections that have been idle longer than
+    health_check_interval are pinged before they are given out.
+    Driver errors are converted to django.db.DatabaseError.
+
+    If connection is requested with timeout, query that is still running after timeout
+    and kill_delay seconds is killed from separate connection by shared watchdog thread.
+    It guards against servers that do not support execution time limit hints.
+    Interrupted queries raise QueryTimeoutError.
+    """
+
+    def __init__(self, parameters, max_size=10, idle_timeout=300, wait_timeout=30,
+                 health_check_interval=30, connect_timeout=10, kill_delay=1):
+        self.parameters = parameters
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout
+        self.health_check_interval = health_check_interval
+        self.connect_timeout = connect_timeout
+        self.kill_delay = kill_delay
+        self._idle = deque()  # (connection, release time) pairs, most recently released last
+        self._size = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        connection = self._acquire()
+        watched_query = None
+        if timeout:
+            watched_query = query_watchdog.watch(self, connection, timeout + self.kill_delay)
+        # Connection state is unknown after failed or interrupted query, it should not be reused.
+        broken = True
+        try:
+            yield connection
+            broken = False
+        except Exception:
+            exc_info = sys.exc_info()
+            if watched_query is not None and watched_query.killed:
+                exc_info = self._get_timeout_error(exc_info, timeout)
+            six.reraise(*self._convert_error(exc_info, timeout))
+        finally:
+            # Kill that has been already started is completed before connection is released,
+            # so it can not interrupt next query of this connection.
+            if watched_query is not None and query_watchdog.cancel(watched_query):
+                broken = True
+            self._release(connection, broken=broken)
+
+    def stream(self, query, parameters=None, chunk_size=1000, timeout=None):
+        """
+        Yield rows of query result that are fetched from server by chunks with unbuffered cursor,
+        so result set is not loaded into memory at once. Connection is held until all rows are read.
+        """
+        from MySQLdb.cursors import SSCursor
+
+        with self.connection(timeout) as connection:
+            cursor = connection.cursor(SSCursor)
+            try:
+                cursor.execute(query, parameters)
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield row
+            finally:
+                cursor.close()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, deque()
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for connection, _ in idle:
+            self._close_connection(connection)
+
+    def _acquire(self):
+        deadline = time.time() + self.wait_timeout
+        while True:
+            connection, released, expired = None, None, []
+            with self._condition:
+                while True:
+                    if self._closed:
+                        raise DatabaseError('Zabbix DB connection pool is closed.')
+                    expired = self._pop_expired()
+                    if self._idle:
+                        connection, released = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise DatabaseError(
+                            'Timeout of waiting for free Zabbix DB connection. Pool size: %s.' % self.max_size)
+                    self._condition.wait(remaining)
+
+            for expired_connection in expired:
+                self._close_connection(expired_connection)
+
+            if connection is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    self._discard()
+                    six.reraise(*self._convert_error(sys.exc_info()))
+
+            if time.time() - released < self.health_check_interval or self._is_healthy(connection):
+                return connection
+            self._discard(connection)
+
+    def _release(self, connection, broken=False):
+        with self._condition:
+            if not broken and not self._closed:
+                self._idle.append((connection, time.time()))
+                self._condition.notify()
+                return
+        self._discard(connection)
+
+    def _discard(self, connection=None):
+        if connection is not None:
+            self._close_connection(connection)
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    def _pop_expired(self):
+        """ Remove connections that have been idle for too long. Oldest connections are at the left side. """
+        expired = []
+        now = time.time()
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            expired.append(self._idle.popleft()[0])
+            self._size -= 1
+        return expired
+
+    def _connect(self):
+        import MySQLdb
+
+        return MySQLdb.connect(
+            host=self.parameters['host'],
+            port=int(self.parameters['port']),
+            db=self.parameters['name'],
+            user=self.parameters['user'],
+            passwd=self.parameters['password'],
+            connect_timeout=self.connect_timeout,
+            charset='utf8',
+            autocommit=True,
+        )
+
+    def _is_healthy(self, connection):
+        try:
+            connection.ping()
+        except Exception as e:
+            logger.info('Zabbix DB connection is not healthy and will be reopened. Error: %s', e)
+            return False
+        return True
+
+    def _close_connection(self, connection):
+        try:
+            connection.close()
+        except Exception:  # nosec
+            pass
+
+    def _convert_error(self, exc_info, timeout=None):
+        exc_type, exc_value, exc_traceback = exc_info
+        if isinstance(exc_value, DatabaseError) or not self._is_driver_error(exc_value):
+            return exc_info
+        if exc_value.args and exc_value.args[0] in QUERY_TIMEOUT_ERROR_CODES:
+            return self._get_timeout_error(exc_info, timeout)
+        return DatabaseError, DatabaseError(*exc_value.args), exc_traceback
+
+    def _get_timeout_error(self, exc_info, timeout):
+        error = QueryTimeoutError('Query execution has exceeded time limit of %s seconds.' % timeout)
+        return QueryTimeoutError, error, exc_info[2]
+
+    def _is_driver_error(self, error):
+        try:
+            import MySQLdb
+        except ImportError:
+            return False
+        return isinstance(error, MySQLdb.Error)
+
+
+class WatchedQuery(object):
+    """ Query that is executed by given connection of the pool and is watched by ZabbixQueryWatchdog """
+
+    def __init__(self, pool, connection):
+        self.pool = pool
+        self.connection = connection
+        self.cancelled = False
+        self.killed = False
+        self.finished = False
+
+
+class ZabbixQueryWatchdog(object):
+    """
+    Per-process watchdog that kills queries which are still running after their deadline.
+    One thread serves all watched queries, so queries do not start a thread each.
+    Queries are either cancelled before the kill starts or their kill is completed before cancel returns.
+    """
+
+    def __init__(self):
+        self._queue = []  # heap of (deadline, sequence number, watched query)
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._pid = None
+
+    def watch(self, pool, connection, timeout):
+        query = WatchedQuery(pool, connection)
+        with self._condition:
+            self._ensure_thread()
+            heapq.heappush(self._queue, (time.time() + timeout, next(self._counter), query))
+            self._condition.notify()
+        return query
+
+    def cancel(self, query):
+        """ Stop watching query. Returns True if query has been killed. """
+        with self._condition:
+            if not query.killed:
+                # Cancelled query is removed from the queue by watchdog thread.
+                query.cancelled = True
+                return False
+            while not query.finished:
+                self._condition.wait()
+            return True
+
+    def _ensure_thread(self):
+        if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+            # Thread of parent process is not available after fork.
+            self._queue = []
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='ZabbixQueryWatchdog')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                query = self._get_expired_query()
+                while query is None:
+                    timeout = self._queue[0][0] - time.time() if self._queue else None
+                    self._condition.wait(timeout)
+                    query = self._get_expired_query()
+                # Flag is set in advance, because interrupted query can fail before KILL QUERY returns.
+                query.killed = True
+            try:
+                self._kill(query)
+            finally:
+                with self._condition:
+                    query.finished = True
+                    self._condition.notify_all()
+
+    def _get_expired_query(self):
+        while self._queue and self._queue[0][2].cancelled:
+            heapq.heappop(self._queue)
+        if self._queue and self._queue[0][0] <= time.time():
+            return heapq.heappop(self._queue)[2]
+        return None
+
+    def _kill(self, query):
+        try:
+            thread_id = int(query.connection.thread_id())
+            killer = query.pool._connect()
+            try:
+                killer.cursor().execute('KILL QUERY %d' % thread_id)
+            finally:
+                query.pool._close_connection(killer)
+        except Exception as e:
+            logger.warning('Can not kill Zabbix DB query that exceeded time limit. Error: %s', e)
+        else:
+            logger.warning('Zabbix DB query that exceeded time limit has been killed. Connection ID: %s.', thread_id)
+
+
+class ZabbixDBPools(object):
+    """
+    Per-process registry of Zabbix DB connection pools.
+    Pool is shared by all backends of the same service settings and recreated if database parameters are changed.
+    Service settings can have several pools: one for primary database and one for each read replica.
+    """
+
+    def __init__(self):
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def get(self, settings, parameters, server='primary', **options):
+        key = (settings.uuid.hex, server)
+        pool_parameters = tuple(sorted((name, six.text_type(value)) for name, value in parameters.items()))
+        stale_pool = None
+        with self._lock:
+            if self._pid != os.getpid():
+                # Connections should not be shared with parent process after fork.
+                self._pools = {}
+                self._pid = os.getpid()
+            if key in self._pools:
+                current_parameters, pool = self._pools[key]
+                if current_parameters == pool_parameters:
+                    return pool
+                stale_pool = pool
+            pool = ZabbixDBConnectionPool(parameters, **options)
+            self._pools[key] = (pool_parameters, pool)
+
+        if stale_pool is not None:
+            stale_pool.close()
+        return pool
+
+    def invalidate(self, settings):
+        with self._lock:
+            keys = [key for key in self._pools if key[0] == settings.uuid.hex]
+            pools = [self._pools.pop(key)[1] for key in keys]
+        for pool in pools:
+            pool.close()
+
+
+class ZabbixQueryResult(object):
+    """
+    Rows of executed query. Rows are fetched right after execution,
+    so connection is returned to the pool before result is processed.
+    """
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class ZabbixDBReplicaMonitor(object):
+    """
+    Per-process cache of read replicas health.
+    Replica is healthy if it is reachable and its replication lag does not exceed given maximum.
+    Health is checked at most once per check_interval seconds.
+    """
+
+    def __init__(self, check_interval=30):
+        self.check_interval = check_interval
+        self._checks = {}
+        self._lock = threading.Lock()
+
+    def is_healthy(self, pool, max_lag):
+        with self._lock:
+            checked = self._checks.get(pool)
+        if checked is not None and time.time() - checked[0] < self.check_interval:
+            return checked[1]
+
+        healthy = self._check(pool, max_lag)
+        with self._lock:
+            self._checks[pool] = (time.time(), healthy)
+        return healthy
+
+    def mark_unhealthy(self, pool):
+        with self._lock:
+            self._checks[pool] = (time.time(), False)
+
+    def _check(self, pool, max_lag):
+        try:
+            lag = self._get_replication_lag(pool)
+        except DatabaseError as e:
+            logger.warning('Zabbix DB replica %s is not available. Error: %s', pool.parameters['host'], e)
+            return False
+        if lag is None or lag > max_lag:
+            logger.warning('Zabbix DB replica %s is lagging behind. Lag: %s seconds, maximum: %s seconds.',
+                           pool.parameters['host'], lag, max_lag)
+            return False
+        return True
+
+    def _get_replication_lag(self, pool):
+        """ Return replication lag in seconds or None if replication is stopped. """
+        with pool.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute('SHOW SLAVE STATUS')
+                row = cursor.fetchone()
+                columns = [column[0] for column in cursor.description or []]
+            finally:
+                cursor.close()
+        if row is None:
+            # Server is not configured as replica, so its data is up to date.
+            return 0
+        return dict(zip(columns, row)).get('Seconds_Behind_Master')
+
+
+db_pools = ZabbixDBPools()
+query_watchdog = ZabbixQueryWatchdog()
+replica_monitor = ZabbixDBReplicaMonitor()
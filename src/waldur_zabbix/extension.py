@@ -10,6 +10,21 @@ class ZabbixExtension(WaldurExtension):
                 'SMS_EMAIL_FROM': None,
                 'SMS_EMAIL_RCPT': None,
             },
+            # Trigger status responses are cached for given number of seconds, 0 disables cache.
+            'TRIGGER_STATUS_CACHE_TIMEOUT': 10,
+            # Item values that are not changed anymore are cached for given number of seconds, 0 disables cache.
+            'ITEMS_STATS_CACHE_TIMEOUT': 60 * 60,
+            # Maximum number of Zabbix database queries that are executed in parallel to serve one request.
+            'MAX_CONCURRENT_QUERIES': 5,
+            # Execution time limit of Zabbix database queries in seconds per endpoint,
+            # 'default' limit is used by other endpoints and background tasks. None disables limit.
+            'QUERY_TIMEOUTS': {
+                'default': 300,
+                'items_history': 30,
+                'aggregated_items_history': 60,
+                'items_values': 30,
+                'items_aggregated_values': 60,
+            },
             'TRIGGER_FIELDS': (
                 # matching trigger object fields and TriggerResponseSerializer fields
                 # https://www.zabbix.com/documentation/3.4/manual/api/reference/trigger/object
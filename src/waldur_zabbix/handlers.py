@@ -27,4 +27,6 @@ def delete_hosts_on_scope_deletion(sender, instance, name, source, target, **kwa
 
 def refresh_database_connection(sender, instance, created=False, **kwargs):
     if not created and instance.type == 'Zabbix' and instance.tracker.has_changed('options'):
-        instance.get_backend()._get_db_connection(force=True)
+        backend = instance.get_backend()
+        backend.reset_api()
+        backend.reset_db_pool()
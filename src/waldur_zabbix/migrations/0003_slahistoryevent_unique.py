@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2026-10-18 09:12
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def remove_duplicate_events(apps, schema_editor):
+    SlaHistoryEvent = apps.get_model('waldur_zabbix', 'SlaHistoryEvent')
+    duplicates = SlaHistoryEvent.objects.values('history', 'timestamp', 'state').annotate(
+        min_id=Min('id'), count=Count('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        SlaHistoryEvent.objects.filter(
+            history=duplicate['history'],
+            timestamp=duplicate['timestamp'],
+            state=duplicate['state'],
+        ).exclude(id=duplicate['min_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('waldur_zabbix', '0002_add_trigger_priority'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_events, reverse_code=migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='slahistoryevent',
+            unique_together=set([('history', 'timestamp', 'state')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2026-10-18 10:03
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('waldur_zabbix', '0003_slahistoryevent_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='template',
+            name='fingerprint',
+            field=models.CharField(blank=True, help_text='Hash of template items, triggers and children.', max_length=40),
+        ),
+    ]
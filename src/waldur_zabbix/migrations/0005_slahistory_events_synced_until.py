@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2026-10-18 12:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('waldur_zabbix', '0004_template_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='slahistory',
+            name='events_synced_until',
+            field=models.IntegerField(blank=True, help_text='Timestamp up to which trigger events have been ingested.', null=True),
+        ),
+    ]
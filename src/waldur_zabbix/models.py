@@ -101,6 +101,8 @@ Host._meta.get_field('name').max_length = 64
 
 class Template(structure_models.ServiceProperty):
     parents = models.ManyToManyField('Template', related_name='children')
+    fingerprint = models.CharField(
+        max_length=40, blank=True, help_text='Hash of template items, triggers and children.')
 
     @classmethod
     def get_url_name(cls):
@@ -233,6 +235,8 @@ class SlaHistory(models.Model):
     itservice = models.ForeignKey(ITService)
     period = models.CharField(max_length=10)
     value = models.DecimalField(max_digits=11, decimal_places=4, null=True, blank=True)
+    events_synced_until = models.IntegerField(
+        null=True, blank=True, help_text='Timestamp up to which trigger events have been ingested.')
 
     class Meta:
         verbose_name = 'SLA history'
@@ -254,6 +258,9 @@ class SlaHistoryEvent(models.Model):
     timestamp = models.IntegerField()
     state = models.CharField(max_length=1, choices=EVENTS)
 
+    class Meta:
+        unique_together = ('history', 'timestamp', 'state')
+
     def __str__(self):
         return '%s - %s' % (self.timestamp, self.state)
 
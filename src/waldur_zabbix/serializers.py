@@ -314,6 +314,20 @@ class ItemsAggregatedValuesSerializer(serializers.Serializer):
         return data
 
 
+class ItemsHistoryDownsamplingSerializer(serializers.Serializer):
+    """ Validate downsampling parameters for items_history and aggregated_items_history actions. """
+    downsample = serializers.ChoiceField(choices=('avg', 'min', 'max', 'last'), required=False)
+
+    def validate(self, data):
+        """
+        Check that points are evenly spaced.
+        """
+        if data.get('downsample') and self.initial_data.getlist('point'):
+            raise serializers.ValidationError(
+                'Downsampling is available only for points defined by start, end and points_count.')
+        return data
+
+
 class UserGroupSerializer(structure_serializers.BasePropertySerializer):
     class Meta(object):
         model = models.UserGroup
@@ -1,20 +1,27 @@
 import datetime
 from decimal import Decimal
 import logging
+import time
 
 from celery import shared_task
 from dateutil.relativedelta import relativedelta
 from django.contrib.contenttypes.models import ContentType
 from django.core.mail import send_mail
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+from django.utils import six
 
 from waldur_core.core import tasks as core_tasks, utils as core_utils
 from waldur_core.monitoring.models import ResourceItem, ResourceSla, ResourceSlaStateTransition
 from waldur_core.monitoring.utils import format_period
 
+from . import utils
 from .backend import ZabbixBackendError
-from .models import Host, ITService, Item, SlaHistory
+from .models import Host, ITService, Item, SlaHistory, SlaHistoryEvent
 
 logger = logging.getLogger(__name__)
+# Events of the last minutes can be stored by Zabbix later, so they are fetched again on the next update
+EVENTS_SYNC_DELAY_SECONDS = 5 * 60
 
 
 @shared_task(name='waldur_core.zabbix.pull_sla')
@@ -40,19 +47,27 @@ def pull_sla(host_uuid):
         # Get dates of first and last service alarm
         min_dt, max_dt = backend.get_sla_range(itservice.backend_id)
     except ZabbixBackendError as e:
-        logger.warning('Unable to pull SLA for host with with UUID %s because of database error: %s', host_uuid, e)
+        logger.warning('Unable to pull SLA for host with UUID %s because of database error: %s', host_uuid, e)
         return
 
     # Shift date to beginning of the month
+    periods = []
     current_point = min_dt.replace(day=1)
     while current_point <= max_dt:
         period = format_period(current_point)
         start_time = core_utils.datetime_to_timestamp(current_point)
         current_point += relativedelta(months=+1)
         end_time = core_utils.datetime_to_timestamp(min(max_dt, current_point))
-        update_itservice_sla.delay(itservice.pk, period, start_time, end_time)
+        periods.append((period, start_time, end_time))
 
-    logger.debug('Successfully pulled SLA for host with with UUID %s', host_uuid)
+    # SLAs of all months and all events are pulled with one request
+    try:
+        _update_itservices_sla(backend, [itservice], periods)
+    except ZabbixBackendError as e:
+        logger.warning('Unable to pull SLA for host with UUID %s. Reason: %s', host_uuid, e)
+        return
+
+    logger.debug('Successfully pulled SLA for host with UUID %s', host_uuid)
 
 
 @shared_task(name='waldur_core.zabbix.update_sla')
@@ -73,8 +88,31 @@ def update_sla(sla_type):
 
     end_time = int(dt.strftime("%s"))
 
-    for itservice in ITService.objects.all():
-        update_itservice_sla.delay(itservice.pk, period, start_time, end_time)
+    settings_pks = ITService.objects.values_list('service_project_link__service__settings', flat=True).distinct()
+    for settings_pk in settings_pks:
+        update_settings_sla.delay(settings_pk, period, start_time, end_time)
+
+
+@shared_task
+def update_settings_sla(settings_pk, period, start_time, end_time):
+    """
+    Update SLAs of all IT services of given service settings with one Zabbix request
+    """
+    logger.debug('Updating SLAs for IT Services of settings with PK %s. Period: %s, start_time: %s, end_time: %s',
+                 settings_pk, period, start_time, end_time)
+
+    itservices = ITService.objects.filter(service_project_link__service__settings=settings_pk)
+    itservices = list(itservices.exclude(backend_id='').select_related('host'))
+    if not itservices:
+        return
+
+    backend = itservices[0].get_backend()
+    try:
+        _update_itservices_sla(backend, itservices, [(period, start_time, end_time)])
+    except ZabbixBackendError as e:
+        logger.warning('Unable to update SLA for IT Services of settings with PK %s. Reason: %s', settings_pk, e)
+    else:
+        logger.debug('Successfully updated SLA for %s IT Services of settings with PK %s', len(itservices), settings_pk)
 
 
 @shared_task
@@ -88,63 +126,321 @@ def update_itservice_sla(itservice_pk, period, start_time, end_time):
         logger.warning('Unable to update SLA for IT Service with PK %s, because it is gone', itservice_pk)
         return
 
-    backend = itservice.host.get_backend()
+    backend = itservice.get_backend()
 
     try:
-        current_sla = backend.get_sla(itservice.backend_id, start_time, end_time)
-        entry, _ = SlaHistory.objects.get_or_create(itservice=itservice, period=period)
-        entry.value = Decimal(current_sla)
-        entry.save()
-
-        # Save SLA if IT service is marked as main for host
-        if itservice.host and itservice.host.scope and itservice.is_main:
-            ResourceSla.objects.update_or_create(
-                object_id=itservice.host.scope.id,
-                content_type=ContentType.objects.get_for_model(itservice.host.scope),
-                period=period,
-                defaults={
-                    'value': current_sla,
-                    'agreed_value': itservice.agreed_sla
-                }
-            )
-
-        if itservice.backend_trigger_id:
-            # update connected events
-            events = backend.get_trigger_events(itservice.backend_trigger_id, start_time, end_time)
-            for event in events:
-                event_state = 'U' if int(event['value']) == 0 else 'D'
-                entry.events.get_or_create(
-                    timestamp=int(event['timestamp']),
-                    state=event_state
-                )
-
-                if itservice.host and itservice.host.scope and itservice.is_main:
-                    ResourceSlaStateTransition.objects.get_or_create(
-                        scope=itservice.host.scope,
-                        period=period,
-                        timestamp=int(event['timestamp']),
-                        state=int(event['value']) == 0
-                    )
+        _update_itservices_sla(backend, [itservice], [(period, start_time, end_time)])
     except ZabbixBackendError as e:
         logger.warning(
             'Unable to update SLA for IT Service %s (ID: %s). Reason: %s', itservice.name, itservice.backend_id, e)
     logger.debug('Successfully updated SLA for IT Service %s (ID: %s)', itservice.name, itservice.backend_id)
 
 
+def _update_itservices_sla(backend, itservices, periods):
+    """
+    Pull SLA values and trigger events of IT services for given periods and store them in bulk.
+    Periods are defined as list of (<period>, <start_time>, <end_time>) tuples.
+    """
+    # yearly period is passed as integer
+    periods = [(six.text_type(period), start_time, end_time) for period, start_time, end_time in periods]
+    intervals = [(start_time, end_time) for _, start_time, end_time in periods]
+    slas = backend.get_slas([itservice.backend_id for itservice in itservices], intervals)
+    # IT services without SLA values in Zabbix response are not updated
+    itservices = [itservice for itservice in itservices if itservice.backend_id in slas]
+
+    histories = _save_sla_histories(itservices, periods, slas)
+    main_itservices = [itservice for itservice in itservices
+                       if itservice.host and itservice.host.object_id is not None and itservice.is_main]
+    _save_resource_slas(main_itservices, periods, slas)
+
+    trigger_ids = set(itservice.backend_trigger_id for itservice in itservices if itservice.backend_trigger_id)
+    if not trigger_ids:
+        return
+
+    # update connected events, only events that are newer than already ingested ones are fetched
+    # Histories that have not been synced yet start from their last stored event
+    last_timestamps = _get_last_event_timestamps(
+        [entry for entry in histories.values() if entry.events_synced_until is None])
+    periods_starts = {}  # map (<itservice pk>, <period>) -> timestamp of first event that should be fetched
+    for (itservice_pk, period), entry in histories.items():
+        start_time = next(start for name, start, _ in periods if name == period)
+        synced_until = entry.events_synced_until or last_timestamps.get(entry.pk) or start_time
+        periods_starts[(itservice_pk, period)] = max(start_time, synced_until)
+
+    # Events of each trigger are fetched from the earliest start of its periods,
+    # triggers with the same start are fetched with one request.
+    itservices_by_pk = {itservice.pk: itservice for itservice in itservices}
+    triggers_starts = {}
+    for (itservice_pk, _), start_time in periods_starts.items():
+        trigger_id = itservices_by_pk[itservice_pk].backend_trigger_id
+        if trigger_id:
+            triggers_starts[trigger_id] = min(start_time, triggers_starts.get(trigger_id, start_time))
+    starts_triggers = {}
+    for trigger_id, start_time in triggers_starts.items():
+        starts_triggers.setdefault(start_time, set()).add(trigger_id)
+
+    events_end_time = max(end for _, end in intervals)
+    triggers_events = {}
+    for start_time, start_trigger_ids in sorted(starts_triggers.items()):
+        triggers_events.update(backend.get_triggers_events(start_trigger_ids, start_time, events_end_time))
+    periods_events = {}  # map (<itservice pk>, <period>) -> list of events
+    for itservice in itservices:
+        for event in triggers_events.get(itservice.backend_trigger_id, []):
+            timestamp = int(event['timestamp'])
+            for period, start_time, end_time in periods:
+                if start_time <= timestamp <= end_time:
+                    if timestamp >= periods_starts[(itservice.pk, period)]:
+                        periods_events.setdefault((itservice.pk, period), []).append(event)
+                    break
+
+    _save_sla_history_events(histories, periods_events, periods_starts)
+    _save_resource_sla_state_transitions(main_itservices, periods_events)
+    _save_events_synced_until(histories, periods)
+
+
+def _get_last_event_timestamps(histories):
+    """ Returns map <SlaHistory pk> -> timestamp of the last ingested event """
+    rows = SlaHistoryEvent.objects.filter(history__in=histories).values('history').annotate(
+        last_timestamp=Max('timestamp'))
+    return {row['history']: row['last_timestamp'] for row in rows}
+
+
+def _save_sla_histories(itservices, periods, slas):
+    """ Create or update SlaHistory for each IT service and period. Returns map (<itservice pk>, <period>) -> entry """
+    period_names = [period for period, _, _ in periods]
+
+    def get_histories():
+        entries = SlaHistory.objects.filter(itservice__in=itservices, period__in=period_names)
+        return {(entry.itservice_id, entry.period): entry for entry in entries}
+
+    histories = get_histories()
+    new_histories = []
+    changed_histories = []
+    for itservice in itservices:
+        for index, period in enumerate(period_names):
+            value = Decimal(slas[itservice.backend_id][index])
+            entry = histories.get((itservice.pk, period))
+            if entry is None:
+                new_histories.append(SlaHistory(itservice=itservice, period=period, value=value))
+            elif entry.value != value:
+                entry.value = value
+                changed_histories.append(entry)
+
+    utils.bulk_update(changed_histories, ['value'])
+    if new_histories:
+        SlaHistory.objects.bulk_create(new_histories)
+        # primary keys of created objects are not available for MySQL
+        histories = get_histories()
+    return histories
+
+
+def _save_resource_slas(itservices, periods, slas):
+    """ Save SLAs of main IT services as monitoring items of hosts scopes """
+    period_names = [period for period, _, _ in periods]
+    for content_type, content_type_itservices in _group_by_scope_content_type(itservices).items():
+        existing_slas = ResourceSla.objects.filter(
+            content_type=content_type,
+            object_id__in=[itservice.host.object_id for itservice in content_type_itservices],
+            period__in=period_names)
+        existing_slas = {(sla.object_id, sla.period): sla for sla in existing_slas}
+
+        new_slas = []
+        changed_slas = []
+        for itservice in content_type_itservices:
+            for index, period in enumerate(period_names):
+                value = slas[itservice.backend_id][index]
+                sla = existing_slas.get((itservice.host.object_id, period))
+                if sla is None:
+                    new_slas.append(ResourceSla(
+                        content_type=content_type,
+                        object_id=itservice.host.object_id,
+                        period=period,
+                        value=value,
+                        agreed_value=itservice.agreed_sla,
+                    ))
+                else:
+                    sla.value = value
+                    sla.agreed_value = itservice.agreed_sla
+                    changed_slas.append(sla)
+
+        utils.bulk_update(changed_slas, ['value', 'agreed_value'])
+        ResourceSla.objects.bulk_create(new_slas)
+
+
+def _save_sla_history_events(histories, periods_events, periods_starts):
+    if not periods_events:
+        return
+
+    # Events are fetched starting from the last synced timestamp, so only events that are
+    # not older than this timestamp can be already stored.
+    existing_events = set(SlaHistoryEvent.objects.filter(
+        history__in=[histories[key] for key in periods_events],
+        timestamp__gte=min(periods_starts[key] for key in periods_events),
+    ).values_list('history_id', 'timestamp', 'state'))
+
+    new_events = []
+    for (itservice_pk, period), events in periods_events.items():
+        entry = histories[(itservice_pk, period)]
+        for event in events:
+            key = (entry.pk, int(event['timestamp']), 'U' if int(event['value']) == 0 else 'D')
+            if key not in existing_events:
+                existing_events.add(key)
+                new_events.append(SlaHistoryEvent(history=entry, timestamp=key[1], state=key[2]))
+
+    try:
+        with transaction.atomic():
+            SlaHistoryEvent.objects.bulk_create(new_events)
+    except IntegrityError:
+        # Events have been stored by concurrent task, store only missing ones.
+        for event in new_events:
+            SlaHistoryEvent.objects.get_or_create(history=event.history, timestamp=event.timestamp, state=event.state)
+
+
+def _save_events_synced_until(histories, periods):
+    """ Remember timestamp up to which events of SLA histories have been ingested """
+    synced_until = int(time.time()) - EVENTS_SYNC_DELAY_SECONDS
+    periods_ends = {period: min(end_time, synced_until) for period, _, end_time in periods}
+    changed_histories = []
+    for (_, period), entry in histories.items():
+        if periods_ends[period] > (entry.events_synced_until or 0):
+            entry.events_synced_until = periods_ends[period]
+            changed_histories.append(entry)
+    utils.bulk_update(changed_histories, ['events_synced_until'])
+
+
+def _save_resource_sla_state_transitions(itservices, periods_events):
+    for content_type, content_type_itservices in _group_by_scope_content_type(itservices).items():
+        timestamps = [int(event['timestamp']) for events in periods_events.values() for event in events]
+        if not timestamps:
+            continue
+        existing_transitions = set(ResourceSlaStateTransition.objects.filter(
+            content_type=content_type,
+            object_id__in=[itservice.host.object_id for itservice in content_type_itservices],
+            period__in=set(period for _, period in periods_events),
+            timestamp__gte=min(timestamps),
+        ).values_list('object_id', 'period', 'timestamp', 'state'))
+
+        new_transitions = []
+        itservices_map = {itservice.pk: itservice for itservice in content_type_itservices}
+        for (itservice_pk, period), events in periods_events.items():
+            itservice = itservices_map.get(itservice_pk)
+            if itservice is None:
+                continue
+            for event in events:
+                key = (itservice.host.object_id, period, int(event['timestamp']), int(event['value']) == 0)
+                if key not in existing_transitions:
+                    existing_transitions.add(key)
+                    new_transitions.append(ResourceSlaStateTransition(
+                        content_type=content_type,
+                        object_id=key[0],
+                        period=key[1],
+                        timestamp=key[2],
+                        state=key[3],
+                    ))
+
+        ResourceSlaStateTransition.objects.bulk_create(new_transitions)
+
+
+def _group_by_scope_content_type(itservices):
+    itservices_by_content_type = {}
+    for itservice in itservices:
+        content_type = ContentType.objects.get_for_id(itservice.host.content_type_id)
+        itservices_by_content_type.setdefault(content_type, []).append(itservice)
+    return itservices_by_content_type
+
+
 @shared_task(name='waldur_core.zabbix.update_monitoring_items')
 def update_monitoring_items():
     """
     Regularly update value of monitored resources
     """
     hosts = Host.objects.filter(object_id__isnull=False, state=Host.States.OK)
-    for host in hosts:
-        for config in host.MONITORING_ITEMS_CONFIGS:
-            update_host_scope_monitoring_items.delay(host.uuid.hex,
-                                                     zabbix_item_key=config['zabbix_item_key'],
-                                                     monitoring_item_name=config['monitoring_item_name'])
+    settings_pks = hosts.values_list('service_project_link__service__settings', flat=True).distinct()
+    for settings_pk in settings_pks:
+        update_settings_monitoring_items.delay(settings_pk)
     logger.debug('Successfully scheduled monitoring data update for zabbix hosts.')
 
 
+@shared_task
+def update_settings_monitoring_items(settings_pk):
+    """
+    Update monitoring items of all OK hosts of given service settings with one Zabbix request
+    """
+    hosts = Host.objects.filter(
+        service_project_link__service__settings=settings_pk, object_id__isnull=False, state=Host.States.OK)
+    hosts = list(hosts.exclude(backend_id='').select_related('service_project_link__service__settings'))
+    if not hosts:
+        return
+
+    configs = Host.MONITORING_ITEMS_CONFIGS
+    keys = [config['zabbix_item_key'] for config in configs]
+    # Only items that are defined in templates of host are requested from backend
+    host_keys = set(Item.objects.filter(template__hosts__in=hosts, key__in=keys).values_list('template__hosts', 'key'))
+    if not host_keys:
+        return
+
+    backend = hosts[0].get_backend()
+    try:
+        values = backend.get_items_last_values([host.backend_id for host in hosts], keys)
+    except ZabbixBackendError as e:
+        logger.warning('Unable to update monitoring items of hosts of settings with PK %s. Reason: %s', settings_pk, e)
+        return
+
+    resource_items = []
+    for host in hosts:
+        for config in configs:
+            key = config['zabbix_item_key']
+            if (host.pk, key) not in host_keys:
+                continue
+            value = values.get(host.backend_id, {}).get(key)
+            if value is None:
+                logger.warning('Cannot find item with key "%s" for host with id %s', key, host.backend_id)
+                continue
+            resource_items.append((host.content_type_id, host.object_id, config['monitoring_item_name'], value))
+
+    _save_resource_items(resource_items)
+    logger.debug('Successfully updated %s monitoring items of hosts of settings with PK %s',
+                 len(resource_items), settings_pk)
+
+
+def _save_resource_items(resource_items):
+    """
+    Create or update ResourceItem rows in bulk.
+    Items are defined as list of (<content_type_id>, <object_id>, <name>, <value>) tuples.
+    """
+    if not resource_items:
+        return
+
+    existing_items = ResourceItem.objects.filter(
+        content_type_id__in={item[0] for item in resource_items},
+        object_id__in={item[1] for item in resource_items},
+        name__in={item[2] for item in resource_items},
+    )
+    existing_items = {(item.content_type_id, item.object_id, item.name): item for item in existing_items}
+
+    new_items = []
+    changed_items = []
+    for content_type_id, object_id, name, value in resource_items:
+        value = Decimal(value)
+        item = existing_items.get((content_type_id, object_id, name))
+        if item is None:
+            new_items.append(ResourceItem(content_type_id=content_type_id, object_id=object_id, name=name, value=value))
+        elif item.value != value:
+            item.value = value
+            changed_items.append(item)
+
+    utils.bulk_update(changed_items, ['value'])
+    try:
+        with transaction.atomic():
+            ResourceItem.objects.bulk_create(new_items)
+    except IntegrityError:
+        # Items have been created by concurrent task, update them one by one.
+        for item in new_items:
+            ResourceItem.objects.update_or_create(
+                content_type_id=item.content_type_id, object_id=item.object_id, name=item.name,
+                defaults={'value': item.value})
+
+
 @shared_task
 def update_host_scope_monitoring_items(host_uuid, zabbix_item_key, monitoring_item_name):
     host = Host.objects.get(uuid=host_uuid)
@@ -191,19 +487,30 @@ class SMSTask(core_tasks.Task):
 @shared_task(name='waldur_core.zabbix.pull_hosts')
 def pull_hosts():
     pullable_hosts = Host.objects.exclude(backend_id='')  # Cannot pull hosts without backend_id
-    for host in pullable_hosts.filter(state=Host.States.ERRED):
-        serialized_host = core_utils.serialize_instance(host)
-        core_tasks.BackendMethodTask().apply_async(
-            args=(serialized_host, 'pull_host'),
-            link=core_tasks.RecoverTask().si(serialized_host),
-            link_error=core_tasks.ErrorMessageTask().s(serialized_host),
-        )
-    for host in Host.objects.filter(state=Host.States.OK):
-        serialized_host = core_utils.serialize_instance(host)
-        core_tasks.BackendMethodTask().apply_async(
-            args=(serialized_host, 'pull_host'),
-            link_error=core_tasks.ErrorStateTransitionTask().s(serialized_host)
-        )
+    pullable_hosts = pullable_hosts.filter(state__in=(Host.States.OK, Host.States.ERRED))
+    settings_pks = pullable_hosts.values_list('service_project_link__service__settings', flat=True).distinct()
+    for settings_pk in settings_pks:
+        pull_settings_hosts.delay(settings_pk)
+
+
+@shared_task
+def pull_settings_hosts(settings_pk):
+    """
+    Pull all OK and erred hosts of given service settings with one Zabbix request
+    """
+    hosts = Host.objects.exclude(backend_id='').filter(
+        service_project_link__service__settings=settings_pk, state__in=(Host.States.OK, Host.States.ERRED))
+    hosts = list(hosts.select_related('service_project_link__service__settings'))
+    if not hosts:
+        return
+
+    backend = hosts[0].get_backend()
+    try:
+        backend.pull_hosts(hosts)
+    except ZabbixBackendError as e:
+        logger.warning('Unable to pull hosts of settings with PK %s. Reason: %s', settings_pk, e)
+    else:
+        logger.debug('Successfully pulled %s hosts of settings with PK %s', len(hosts), settings_pk)
 
 
 class UpdateSettingsCredentials(core_tasks.Task):
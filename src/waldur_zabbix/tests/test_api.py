@@ -0,0 +1,103 @@
+import mock
+
+from django.test import TestCase
+import pyzabbix
+
+from waldur_core.structure.models import ServiceSettings
+
+from ..apps import ZabbixConfig
+from ..backend import api_pool, ZabbixAPIBatch
+
+
+class ZabbixAPIPoolTest(TestCase):
+    def setUp(self):
+        self.patcher = mock.patch('pyzabbix.ZabbixAPI')
+        self.mocked_api = self.patcher.start()
+        self.settings = ServiceSettings(
+            type=ZabbixConfig.service_name,
+            backend_url='http://example.com',
+            username='admin',
+            password='admin'
+        )
+
+    def tearDown(self):
+        api_pool.invalidate(self.settings)
+        self.patcher.stop()
+
+    def test_api_client_is_shared_between_backends(self):
+        api1 = self.settings.get_backend().api
+        api2 = self.settings.get_backend().api
+
+        self.assertIs(api1, api2)
+        self.assertEqual(self.mocked_api().login.call_count, 1)
+
+    def test_api_client_is_recreated_if_credentials_are_changed(self):
+        self.settings.get_backend().api
+        self.settings.password = 'new_password'
+        self.settings.get_backend().api
+
+        self.mocked_api().login.assert_called_with('admin', 'new_password')
+
+    def test_api_client_is_recreated_after_reset(self):
+        backend = self.settings.get_backend()
+        backend.api
+        backend.reset_api()
+        backend.api
+
+        self.assertEqual(self.mocked_api().login.call_count, 2)
+
+    def test_request_is_repeated_after_relogin_if_token_has_expired(self):
+        api = mock.Mock()
+        api.do_request.side_effect = [
+            pyzabbix.ZabbixAPIException('Error -32602: Invalid params., Session terminated, re-login, please.'),
+            {'result': []},
+        ]
+        api_pool._enable_relogin(api, 'admin', 'admin')
+
+        self.assertEqual(api.do_request('host.get'), {'result': []})
+        api.login.assert_called_once_with('admin', 'admin')
+
+
+class ZabbixAPIBatchTest(TestCase):
+    def setUp(self):
+        self.api = mock.Mock(auth='token', url='http://example.com/api_jsonrpc.php', timeout=None)
+        self.batch = ZabbixAPIBatch(self.api, 'admin', 'admin')
+
+    def set_responses(self, *responses):
+        self.api.session.post.side_effect = [mock.Mock(json=mock.Mock(return_value=r)) for r in responses]
+
+    def test_calls_are_sent_in_one_request(self):
+        self.set_responses([{'id': 1, 'result': ['host']}, {'id': 0, 'result': ['group']}])
+
+        with self.batch as batch:
+            groups = batch.call('hostgroup.get', filter={'name': 'waldur'})
+            hosts = batch.call('host.get', output='hostid')
+
+        self.assertEqual(self.api.session.post.call_count, 1)
+        self.assertEqual(groups.result, ['group'])
+        self.assertEqual(hosts.result, ['host'])
+
+    def test_error_is_raised_on_result_access(self):
+        self.set_responses([{'id': 0, 'error': {'code': -32602, 'message': 'Invalid params.', 'data': 'No host'}}])
+
+        with self.batch as batch:
+            hosts = batch.call('host.get', output='hostid')
+
+        with self.assertRaises(pyzabbix.ZabbixAPIException):
+            hosts.result
+
+    def test_batch_is_repeated_after_relogin_if_token_has_expired(self):
+        error = {'code': -32602, 'message': 'Invalid params.', 'data': 'Session terminated, re-login, please.'}
+        self.set_responses([{'id': 0, 'error': error}], [{'id': 0, 'result': []}])
+
+        with self.batch as batch:
+            hosts = batch.call('host.get', output='hostid')
+
+        self.api.login.assert_called_once_with('admin', 'admin')
+        self.assertEqual(hosts.result, [])
+
+    def test_empty_batch_is_not_sent(self):
+        with self.batch:
+            pass
+
+        self.assertFalse(self.api.session.post.called)
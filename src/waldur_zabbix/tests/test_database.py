@@ -0,0 +1,206 @@
+import mock
+import time
+
+from django.db import DatabaseError
+from django.test import TestCase
+
+from waldur_core.structure.models import ServiceSettings
+
+from ..apps import ZabbixConfig
+from ..backend import ZabbixQueryTimeoutError
+from ..database import QueryTimeoutError, ZabbixDBConnectionPool, ZabbixDBReplicaMonitor
+
+
+class ZabbixDBConnectionPoolTest(TestCase):
+    def setUp(self):
+        self.pool = ZabbixDBConnectionPool({}, max_size=2, wait_timeout=0.01)
+        patcher = mock.patch.object(self.pool, '_connect', side_effect=lambda: mock.Mock())
+        self.mocked_connect = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_released_connection_is_reused(self):
+        with self.pool.connection() as connection1:
+            pass
+        with self.pool.connection() as connection2:
+            pass
+
+        self.assertIs(connection1, connection2)
+        self.assertEqual(self.mocked_connect.call_count, 1)
+
+    def test_error_is_raised_if_pool_is_exhausted(self):
+        with self.pool.connection(), self.pool.connection():
+            with self.assertRaises(DatabaseError):
+                with self.pool.connection():
+                    pass
+
+    def test_connection_is_not_reused_after_error(self):
+        with self.assertRaises(ValueError):
+            with self.pool.connection() as connection1:
+                raise ValueError()
+        with self.pool.connection() as connection2:
+            pass
+
+        self.assertIsNot(connection1, connection2)
+        self.assertTrue(connection1.close.called)
+
+    def test_idle_connection_is_closed_after_timeout(self):
+        self.pool.idle_timeout = -1
+        with self.pool.connection() as connection1:
+            pass
+        with self.pool.connection() as connection2:
+            pass
+
+        self.assertIsNot(connection1, connection2)
+        self.assertTrue(connection1.close.called)
+
+    def test_unhealthy_connection_is_replaced(self):
+        self.pool.health_check_interval = -1
+        with self.pool.connection() as connection1:
+            pass
+        connection1.ping.side_effect = Exception('MySQL server has gone away')
+        with self.pool.connection() as connection2:
+            pass
+
+        self.assertIsNot(connection1, connection2)
+
+    def test_query_is_killed_after_timeout(self):
+        self.pool.kill_delay = 0
+        connection, killer = mock.Mock(), mock.Mock()
+        connection.thread_id.return_value = 42
+        self.mocked_connect.side_effect = [connection, killer, mock.Mock()]
+
+        with self.assertRaises(QueryTimeoutError):
+            with self.pool.connection(timeout=0.01):
+                time.sleep(0.1)
+                raise Exception('Query execution was interrupted')
+
+        killer.cursor().execute.assert_called_once_with('KILL QUERY 42')
+        with self.pool.connection() as connection2:
+            pass
+        self.assertIsNot(connection, connection2)
+
+    def test_connection_is_released_after_started_kill_is_completed(self):
+        self.pool.kill_delay = 0
+        connection, killer = mock.Mock(), mock.Mock()
+        connection.thread_id.return_value = 42
+        completed_kills = []
+        killer.cursor().execute.side_effect = lambda query: time.sleep(0.1) or completed_kills.append(query)
+        self.mocked_connect.side_effect = [connection, killer]
+
+        with self.pool.connection(timeout=0.01):
+            time.sleep(0.05)
+
+        self.assertEqual(completed_kills, ['KILL QUERY 42'])
+        self.assertTrue(connection.close.called)
+
+    def test_query_is_not_killed_if_it_is_completed_in_time(self):
+        with self.pool.connection(timeout=0.01) as connection1:
+            pass
+        time.sleep(0.05)
+        with self.pool.connection() as connection2:
+            pass
+
+        self.assertIs(connection1, connection2)
+        self.assertEqual(self.mocked_connect.call_count, 1)
+
+
+class ZabbixDBReplicaMonitorTest(TestCase):
+    def setUp(self):
+        self.monitor = ZabbixDBReplicaMonitor()
+        self.pool = ZabbixDBConnectionPool({'host': 'replica'})
+        self.cursor = mock.Mock(description=[('Slave_IO_State',), ('Seconds_Behind_Master',)])
+        connection = mock.Mock()
+        connection.cursor.return_value = self.cursor
+        patcher = mock.patch.object(self.pool, '_connect', return_value=connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_replica_is_healthy_if_lag_is_small(self):
+        self.cursor.fetchone.return_value = ('Waiting for master', 5)
+        self.assertTrue(self.monitor.is_healthy(self.pool, max_lag=30))
+
+    def test_replica_is_unhealthy_if_lag_is_large(self):
+        self.cursor.fetchone.return_value = ('Waiting for master', 60)
+        self.assertFalse(self.monitor.is_healthy(self.pool, max_lag=30))
+
+    def test_replica_is_unhealthy_if_replication_is_stopped(self):
+        self.cursor.fetchone.return_value = ('', None)
+        self.assertFalse(self.monitor.is_healthy(self.pool, max_lag=30))
+
+    def test_health_check_result_is_cached(self):
+        self.cursor.fetchone.return_value = ('Waiting for master', 5)
+        self.monitor.is_healthy(self.pool, max_lag=30)
+        self.monitor.is_healthy(self.pool, max_lag=30)
+
+        self.assertEqual(self.cursor.execute.call_count, 1)
+
+
+class ReadOnlyQueryRoutingTest(TestCase):
+    def setUp(self):
+        settings = ServiceSettings(type=ZabbixConfig.service_name, backend_url='http://example.com')
+        self.backend = settings.get_backend()
+        self.primary_pool = self.get_pool([(1,)])
+        self.replica_pool = self.get_pool([(2,)])
+        patchers = [
+            mock.patch.object(self.backend, '_get_db_pool', return_value=self.primary_pool),
+            mock.patch.object(self.backend, '_get_replica_pool', return_value=self.replica_pool),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_pool(self, rows):
+        pool = ZabbixDBConnectionPool({'host': 'example.com'})
+        connection = mock.Mock()
+        connection.cursor.return_value.fetchall.return_value = rows
+        patcher = mock.patch.object(pool, '_connect', return_value=connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return pool
+
+    def test_read_only_query_is_executed_by_replica(self):
+        result = self.backend._execute_query('SELECT 1', read_only=True)
+        self.assertEqual(result.fetchall(), [(2,)])
+
+    def test_other_queries_are_executed_by_primary(self):
+        result = self.backend._execute_query('SELECT 1')
+        self.assertEqual(result.fetchall(), [(1,)])
+
+    def test_primary_is_used_if_replica_fails(self):
+        self.replica_pool._connect.return_value.cursor.return_value.execute.side_effect = DatabaseError()
+
+        result = self.backend._execute_query('SELECT 1', read_only=True)
+
+        self.assertEqual(result.fetchall(), [(1,)])
+
+    def test_timed_out_query_is_not_repeated_by_primary(self):
+        self.replica_pool._connect.return_value.cursor.return_value.execute.side_effect = QueryTimeoutError()
+
+        with self.assertRaises(ZabbixQueryTimeoutError):
+            self.backend._execute_query('SELECT 1', read_only=True)
+
+        self.assertFalse(self.primary_pool._connect.called)
+
+    def test_duration_of_executed_query_is_recorded(self):
+        self.backend.query_timeout = None
+        self.backend._execute_query('SELECT itemid FROM items WHERE itemid IN %(item_ids)s', {'item_ids': [1, 2]})
+
+        query, duration = self.backend.query_durations[-1]
+        self.assertEqual(query, 'SELECT itemid FROM items WHERE itemid IN (%(item_ids_0)s, %(item_ids_1)s)')
+        self.assertGreaterEqual(duration, 0)
+
+    def test_execution_time_hint_is_added_to_select_query(self):
+        self.backend.query_timeout = 2.5
+        self.backend._execute_query('SELECT itemid FROM items')
+
+        cursor = self.primary_pool._connect.return_value.cursor.return_value
+        self.assertEqual(cursor.execute.call_args[0][0], 'SELECT /*+ MAX_EXECUTION_TIME(2500) */ itemid FROM items')
+
+    def test_streamed_query_rows_are_fetched_by_chunks(self):
+        cursor = self.primary_pool._connect.return_value.cursor.return_value
+        cursor.fetchmany.side_effect = [[(1,), (2,)], [(3,)], []]
+
+        with mock.patch.dict('sys.modules', {'MySQLdb': mock.Mock(), 'MySQLdb.cursors': mock.Mock()}):
+            rows = self.backend._execute_query('SELECT 1', stream=True)
+            self.assertFalse(cursor.execute.called)
+            self.assertEqual(list(rows), [(1,), (2,), (3,)])
@@ -5,6 +5,7 @@ import pyzabbix
 from requests import RequestException
 from rest_framework import status, test
 
+from waldur_core.monitoring.models import ResourceItem
 from waldur_core.structure import ServiceBackendError
 from waldur_core.structure.models import ServiceSettings
 from waldur_core.structure.tests import factories as structure_factories
@@ -12,6 +13,8 @@ from waldur_core.structure.tests import factories as structure_factories
 from . import factories
 from .. import models
 from ..apps import ZabbixConfig
+from ..backend import api_pool
+from ..tasks import update_settings_monitoring_items
 
 
 class HostApiCreateTest(test.APITransactionTestCase):
@@ -134,3 +137,104 @@ class HostCreateBackendTest(TestCase):
 
         self.mocked_api().host.get.side_effect = pyzabbix.ZabbixAPIException()
         self.assertRaises(ServiceBackendError, self.backend.create_host, host)
+
+
+class HostPullBackendTest(TestCase):
+    def setUp(self):
+        self.patcher = mock.patch('pyzabbix.ZabbixAPI')
+        self.mocked_api = self.patcher.start()
+        self.spl = factories.ZabbixServiceProjectLinkFactory()
+        self.settings = self.spl.service.settings
+        self.backend = self.settings.get_backend()
+
+    def tearDown(self):
+        api_pool.invalidate(self.settings)
+        self.patcher.stop()
+
+    def get_backend_host(self, host, **kwargs):
+        backend_host = {
+            'hostid': host.backend_id,
+            'host': host.name,
+            'name': host.visible_name,
+            'description': host.description,
+            'error': host.error,
+            'status': host.status,
+            'groups': [{'name': host.host_group_name}],
+            'parentTemplates': [],
+        }
+        backend_host.update(kwargs)
+        return backend_host
+
+    def test_all_hosts_are_pulled_with_one_request(self):
+        host1 = factories.HostFactory(service_project_link=self.spl, state=models.Host.States.OK)
+        host2 = factories.HostFactory(service_project_link=self.spl, state=models.Host.States.OK)
+        self.mocked_api().host.get.return_value = [
+            self.get_backend_host(host1, name='New visible name'),
+            self.get_backend_host(host2),
+        ]
+
+        self.backend.pull_hosts([host1, host2])
+
+        self.assertEqual(self.mocked_api().host.get.call_count, 1)
+        host1.refresh_from_db()
+        self.assertEqual(host1.visible_name, 'New visible name')
+
+    def test_host_templates_are_synchronized(self):
+        host = factories.HostFactory(service_project_link=self.spl, state=models.Host.States.OK)
+        old_template = factories.TemplateFactory(settings=self.settings)
+        new_template = factories.TemplateFactory(settings=self.settings)
+        host.templates.add(old_template)
+        self.mocked_api().host.get.return_value = [
+            self.get_backend_host(host, parentTemplates=[{'templateid': new_template.backend_id}]),
+        ]
+
+        self.backend.pull_hosts([host])
+
+        self.assertEqual(list(host.templates.all()), [new_template])
+
+    def test_missing_host_is_marked_as_erred_and_found_host_is_recovered(self):
+        missing_host = factories.HostFactory(service_project_link=self.spl, state=models.Host.States.OK)
+        erred_host = factories.HostFactory(service_project_link=self.spl, state=models.Host.States.ERRED)
+        self.mocked_api().host.get.return_value = [self.get_backend_host(erred_host)]
+
+        self.backend.pull_hosts([missing_host, erred_host])
+
+        missing_host.refresh_from_db()
+        erred_host.refresh_from_db()
+        self.assertEqual(missing_host.state, models.Host.States.ERRED)
+        self.assertEqual(erred_host.state, models.Host.States.OK)
+
+
+class HostMonitoringItemsUpdateTest(TestCase):
+    def setUp(self):
+        self.spl = factories.ZabbixServiceProjectLinkFactory()
+        template = factories.TemplateFactory(settings=self.spl.service.settings)
+        models.Item.objects.create(template=template, key='application.status', name='Application status',
+                                   value_type=models.Item.ValueTypes.INTEGER, history=90, delay=60)
+        self.vms = [structure_factories.TestNewInstanceFactory() for _ in range(2)]
+        self.hosts = [factories.HostFactory(service_project_link=self.spl, scope=vm, state=models.Host.States.OK)
+                      for vm in self.vms]
+        for host in self.hosts:
+            host.templates.add(template)
+
+    @mock.patch('waldur_core.structure.models.ServiceProjectLink.get_backend')
+    def test_items_of_all_hosts_are_fetched_with_one_request(self, mocked_backend):
+        mocked_backend().get_items_last_values.return_value = {
+            host.backend_id: {'application.status': '1'} for host in self.hosts}
+
+        update_settings_monitoring_items(self.spl.service.settings.pk)
+
+        self.assertEqual(mocked_backend().get_items_last_values.call_count, 1)
+        for vm in self.vms:
+            item = ResourceItem.objects.get(object_id=vm.id, name='application_state')
+            self.assertEqual(item.value, 1)
+
+    @mock.patch('waldur_core.structure.models.ServiceProjectLink.get_backend')
+    def test_existing_items_are_updated(self, mocked_backend):
+        vm = self.vms[0]
+        ResourceItem.objects.create(scope=vm, name='application_state', value=0)
+        mocked_backend().get_items_last_values.return_value = {self.hosts[0].backend_id: {'application.status': '1'}}
+
+        update_settings_monitoring_items(self.spl.service.settings.pk)
+
+        self.assertEqual(ResourceItem.objects.get(object_id=vm.id, name='application_state').value, 1)
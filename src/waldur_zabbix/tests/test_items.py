@@ -0,0 +1,233 @@
+import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+
+from waldur_core.core.utils import datetime_to_timestamp
+from waldur_core.structure.models import ServiceSettings
+
+from .. import models
+from ..apps import ZabbixConfig
+from ..backend import ZabbixBackendError
+from ..database import ZabbixQueryResult
+
+
+class ItemsStatsTest(TestCase):
+    def setUp(self):
+        settings = ServiceSettings(
+            type=ZabbixConfig.service_name,
+            backend_url='http://example.com',
+            username='admin',
+            password='admin'
+        )
+        self.backend = settings.get_backend()
+        self.item = models.Item(key='cpu', value_type=models.Item.ValueTypes.FLOAT, history=90, delay=60, units='%')
+        self.now = datetime_to_timestamp(timezone.now())
+        self.points = [self.now - 180, self.now - 120, self.now - 60, self.now]
+
+        patchers = [
+            mock.patch.object(self.backend, '_execute_query'),
+            mock.patch.object(self.backend, '_get_stats_cache_timeout', return_value=0),
+        ]
+        self.mocked_execute_query = patchers[0].start()
+        patchers[1].start()
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    def set_query_results(self, *results):
+        self.mocked_execute_query.side_effect = [ZabbixQueryResult(rows) for rows in results]
+
+    def test_history_of_all_hosts_is_fetched_with_one_query_per_table(self):
+        self.set_query_results(
+            [(1, 10, 'cpu'), (2, 20, 'cpu')],
+            [],
+            [(1, self.now - 10, 5.0), (1, self.now - 70, 4.0), (1, self.now - 130, 3.0), (2, self.now - 5, 7.0)],
+        )
+
+        stats = self.backend.get_items_stats(['10', '20'], [self.item], self.points)
+
+        self.assertEqual(self.mocked_execute_query.call_count, 3)
+        self.assertEqual(stats['10']['cpu'], [3.0, 4.0, 5.0])
+        self.assertEqual(stats['20']['cpu'], [None, None, 7.0])
+
+    def test_trends_are_fetched_before_history_is_streamed(self):
+        self.set_query_results([(1, 10, 'cpu')], [], [(1, self.now - 10, 5.0)])
+
+        self.backend.get_items_stats(['10'], [self.item], self.points)
+
+        trends_call, history_call = self.mocked_execute_query.call_args_list[1:]
+        self.assertIn('FROM trends', trends_call[0][0])
+        self.assertFalse(trends_call[1]['stream'])
+        self.assertIn('FROM history', history_call[0][0])
+        self.assertTrue(history_call[1]['stream'])
+
+    def test_host_without_item_gets_empty_values(self):
+        self.set_query_results([(1, 10, 'cpu')], [], [(1, self.now - 10, 5.0)])
+
+        stats = self.backend.get_items_stats(['10', '20'], [self.item], self.points)
+
+        self.assertEqual(stats['20']['cpu'], [None, None, None])
+
+    def test_non_numeric_items_are_not_supported(self):
+        item = models.Item(key='name', value_type=models.Item.ValueTypes.TEXT, history=90, delay=60)
+        self.assertRaises(ZabbixBackendError, self.backend.get_items_stats, ['10'], [item], self.points)
+
+    def test_downsampled_stats_contain_value_for_each_interval(self):
+        self.set_query_results([(1, 10, 'cpu')], [(1, 0, 2.0), (1, 2, 5.0)])
+
+        stats = self.backend.get_items_downsampled_stats(['10'], [self.item], self.points, 'max')
+
+        self.assertEqual(self.mocked_execute_query.call_count, 2)
+        self.assertEqual(stats['10']['cpu'], [2.0, None, 5.0])
+
+    def test_downsampled_stats_are_aligned_with_closest_values(self):
+        self.set_query_results([(1, 10, 'cpu')], [], [(1, self.now - 70, 4.0)])
+        stats = self.backend.get_items_stats(['10'], [self.item], self.points)
+
+        self.set_query_results([(1, 10, 'cpu')], [(1, 1, 4.0)])
+        downsampled_stats = self.backend.get_items_downsampled_stats(['10'], [self.item], self.points, 'max')
+
+        self.assertEqual(stats['10']['cpu'], [None, 4.0, None])
+        self.assertEqual(downsampled_stats['10']['cpu'], [None, 4.0, None])
+
+    def test_last_value_is_selected_by_time_of_latest_row(self):
+        self.set_query_results([(1, 10, 'cpu')], [(1, 1, 3.5)])
+
+        stats = self.backend.get_items_downsampled_stats(['10'], [self.item], self.points, 'last')
+
+        query = self.mocked_execute_query.call_args[0][0]
+        self.assertIn('MAX(clock)', query)
+        self.assertNotIn('GROUP_CONCAT', query)
+        self.assertEqual(stats['10']['cpu'], [None, 3.5, None])
+
+    def test_values_of_all_hosts_are_aggregated_with_one_query(self):
+        self.set_query_results([(10, 'cpu', 50.0), (20, 'cpu', 70.0)])
+
+        values = self.backend.get_hosts_items_aggregated_values(['10', '20'], [self.item], self.now - 3600, self.now)
+
+        self.assertEqual(self.mocked_execute_query.call_count, 1)
+        query = self.mocked_execute_query.call_args[0][0]
+        self.assertIn('GROUP BY items.hostid, items.key_', query)
+        self.assertEqual(values, {'10': {'cpu': 50.0}, '20': {'cpu': 70.0}})
+
+    def test_values_older_than_history_retention_are_aggregated_from_trends(self):
+        self.set_query_results([(10, 'cpu', 90.0)], [(10, 'cpu', 70.0)])
+        start = self.now - 100 * 24 * 3600
+
+        values = self.backend.get_hosts_items_aggregated_values(['10'], [self.item], start, self.now)
+
+        trends_query = self.mocked_execute_query.call_args_list[0][0][0]
+        history_query = self.mocked_execute_query.call_args_list[1][0][0]
+        self.assertIn('MAX(value_max)', trends_query)
+        self.assertIn('FROM items, trends history', trends_query)
+        self.assertIn('FROM items, history history', history_query)
+        self.assertEqual(values, {'10': {'cpu': 90.0}})
+
+
+class ItemsStatsCacheTest(TestCase):
+    def setUp(self):
+        settings = ServiceSettings(type=ZabbixConfig.service_name, backend_url='http://example.com')
+        self.backend = settings.get_backend()
+        self.item = models.Item(key='cpu', value_type=models.Item.ValueTypes.FLOAT, history=90, delay=60, units='%')
+        self.now = datetime_to_timestamp(timezone.now())
+
+        patchers = [
+            mock.patch.object(self.backend, '_execute_query'),
+            mock.patch.object(self.backend, '_get_stats_cache_timeout', return_value=60),
+        ]
+        self.mocked_execute_query = patchers[0].start()
+        patchers[1].start()
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        self.addCleanup(cache.clear)
+
+    def set_query_results(self, *results):
+        self.mocked_execute_query.reset_mock()
+        self.mocked_execute_query.side_effect = [ZabbixQueryResult(rows) for rows in results]
+
+    def test_closed_intervals_are_served_from_cache(self):
+        points = [self.now - 3600, self.now - 3540, self.now - 3480]
+        self.set_query_results([(1, 10, 'cpu')], [], [(1, self.now - 3500, 5.0), (1, self.now - 3590, 4.0)])
+        stats = self.backend.get_items_stats(['10'], [self.item], points)
+
+        self.set_query_results()
+        cached_stats = self.backend.get_items_stats(['10'], [self.item], points)
+
+        self.assertFalse(self.mocked_execute_query.called)
+        self.assertEqual(cached_stats, stats)
+        self.assertEqual(stats['10']['cpu'], [4.0, 5.0])
+
+    def test_only_open_intervals_are_fetched_if_closed_ones_are_cached(self):
+        points = [self.now - 1000, self.now - 940, self.now - 60, self.now]
+        self.set_query_results([(1, 10, 'cpu')], [], [(1, self.now - 950, 4.0)])
+        self.backend.get_items_stats(['10'], [self.item], points)
+
+        self.set_query_results([(1, 10, 'cpu')], [], [(1, self.now - 10, 5.0), (1, self.now - 900, 3.0)])
+        stats = self.backend.get_items_stats(['10'], [self.item], points)
+
+        history_parameters = self.mocked_execute_query.call_args_list[2][0][1]
+        self.assertEqual(history_parameters['start_timestamp'], self.now - 940 - 60)
+        self.assertEqual(stats['10']['cpu'], [4.0, 3.0, 5.0])
+
+    def test_partially_cached_stats_are_equal_to_not_cached_ones(self):
+        base = self.now - 1300
+        points = [base, base + 100, base + 200, base + 1100]
+        self.set_query_results([(1, 10, 'cpu')], [], [(1, base + 250, 2.0), (1, base + 30, 1.0)])
+        expected_stats = self.backend._get_items_stats(['10'], [self.item], points)
+
+        self.set_query_results([(1, 10, 'cpu')], [], [(1, base + 30, 1.0)])
+        self.backend.get_items_stats(['10'], [self.item], points[:2])
+        # Only intervals starting with the second one are fetched, so older rows are not returned
+        self.set_query_results([(1, 10, 'cpu')], [], [(1, base + 250, 2.0)])
+        stats = self.backend.get_items_stats(['10'], [self.item], points)
+
+        self.assertEqual(expected_stats['10']['cpu'], [1.0, None, 2.0])
+        self.assertEqual(stats, expected_stats)
+
+    def test_aggregated_values_of_closed_buckets_are_served_from_cache(self):
+        bucket = self.now // 3600 - 3
+        start, end = bucket * 3600, (bucket + 2) * 3600 - 1
+        self.set_query_results([(10, 'cpu', bucket, 50.0), (10, 'cpu', bucket + 1, 70.0)])
+        values = self.backend.get_hosts_items_aggregated_values(['10'], [self.item], start, end)
+
+        self.set_query_results()
+        cached_values = self.backend.get_hosts_items_aggregated_values(['10'], [self.item], start, end)
+
+        self.assertFalse(self.mocked_execute_query.called)
+        self.assertEqual(cached_values, values)
+        self.assertEqual(values, {'10': {'cpu': 70.0}})
+
+    def test_aggregated_values_of_partial_buckets_are_not_cached(self):
+        bucket = self.now // 3600 - 3
+        start, end = bucket * 3600 - 600, (bucket + 1) * 3600 - 1
+        self.set_query_results([(10, 'cpu', bucket, 50.0)], [(10, 'cpu', 90.0)])
+        values = self.backend.get_hosts_items_aggregated_values(['10'], [self.item], start, end)
+
+        self.set_query_results([(10, 'cpu', 80.0)])
+        self.backend.get_hosts_items_aggregated_values(['10'], [self.item], start, end)
+
+        self.assertEqual(self.mocked_execute_query.call_count, 1)
+        self.assertEqual(values, {'10': {'cpu': 90.0}})
+
+
+class QueryPreparationTest(TestCase):
+    def setUp(self):
+        settings = ServiceSettings(type=ZabbixConfig.service_name, backend_url='http://example.com')
+        self.backend = settings.get_backend()
+
+    def test_list_parameters_are_expanded_and_bound(self):
+        query, parameters = self.backend._prepare_query(
+            'SELECT itemid FROM items WHERE key_ IN %(keys)s AND hostid = %(hostid)s',
+            {'keys': ['cpu', 'ram', 'disk'], 'hostid': 10})
+
+        self.assertEqual(
+            query,
+            'SELECT itemid FROM items WHERE key_ IN (%(keys_0)s, %(keys_1)s, %(keys_2)s) AND hostid = %(hostid)s')
+        self.assertEqual(parameters, {'keys_0': 'cpu', 'keys_1': 'ram', 'keys_2': 'disk', 'hostid': 10})
+
+    def test_statement_text_does_not_depend_on_values(self):
+        query1, _ = self.backend._prepare_query('SELECT 1 FROM items WHERE key_ IN %(keys)s', {'keys': ['a"', 'b']})
+        query2, _ = self.backend._prepare_query('SELECT 1 FROM items WHERE key_ IN %(keys)s', {'keys': ['c', 'd']})
+
+        self.assertEqual(query1, query2)
@@ -7,7 +7,7 @@ from rest_framework import status, test
 from waldur_core.core.utils import datetime_to_timestamp
 from waldur_core.monitoring.utils import format_period
 from waldur_core.structure.tests import factories as structure_factories
-from waldur_zabbix.tasks import pull_sla
+from waldur_zabbix.tasks import pull_sla, update_settings_sla
 
 from . import factories
 from .. import models
@@ -55,14 +55,15 @@ class SlaViewTest(test.APITransactionTestCase):
 class SlaPullTest(test.APITransactionTestCase):
 
     @mock.patch('waldur_core.structure.models.ServiceProjectLink.get_backend')
-    @mock.patch('waldur_zabbix.tasks.update_itservice_sla')
-    def test_task_calls_backend(self, mock_task, mock_backend):
+    def test_task_calls_backend(self, mock_backend):
         # Given
-        itservice = factories.ITServiceFactory(is_main=True, backend_id='VALID')
+        itservice = factories.ITServiceFactory(is_main=True, backend_id='VALID', backend_trigger_id='TRIGGER')
 
         min_dt = datetime.date.today().replace(day=10) - relativedelta(months=2)
         max_dt = datetime.date.today().replace(day=10) - relativedelta(months=1)
         mock_backend().get_sla_range.return_value = min_dt, max_dt
+        mock_backend().get_slas.return_value = {itservice.backend_id: [99.0, 100.0]}
+        mock_backend().get_triggers_events.return_value = {}
 
         # When
         pull_sla(itservice.host.uuid)
@@ -71,13 +72,149 @@ class SlaPullTest(test.APITransactionTestCase):
         mock_backend().get_sla_range.assert_called_once_with(itservice.backend_id)
         month1_beginning = min_dt.replace(day=1)
         month2_beginning = min_dt.replace(day=1) + relativedelta(months=+1)
-        mock_task.delay.assert_has_calls([
-            mock.call(itservice.pk,
-                      format_period(min_dt),
-                      datetime_to_timestamp(month1_beginning),
-                      datetime_to_timestamp(month2_beginning)),
-            mock.call(itservice.pk,
-                      format_period(max_dt),
-                      datetime_to_timestamp(month2_beginning),
-                      datetime_to_timestamp(max_dt))
+        mock_backend().get_slas.assert_called_once_with([itservice.backend_id], [
+            (datetime_to_timestamp(month1_beginning), datetime_to_timestamp(month2_beginning)),
+            (datetime_to_timestamp(month2_beginning), datetime_to_timestamp(max_dt)),
         ])
+        mock_backend().get_triggers_events.assert_called_once_with(
+            {'TRIGGER'}, datetime_to_timestamp(month1_beginning), datetime_to_timestamp(max_dt))
+        self.assertEqual(models.SlaHistory.objects.get(itservice=itservice, period=format_period(min_dt)).value, 99)
+        self.assertEqual(models.SlaHistory.objects.get(itservice=itservice, period=format_period(max_dt)).value, 100)
+
+    @mock.patch('waldur_core.structure.models.ServiceProjectLink.get_backend')
+    def test_events_are_split_by_periods(self, mock_backend):
+        itservice = factories.ITServiceFactory(is_main=True, backend_id='VALID', backend_trigger_id='TRIGGER')
+
+        min_dt = datetime.date.today().replace(day=10) - relativedelta(months=2)
+        max_dt = datetime.date.today().replace(day=10) - relativedelta(months=1)
+        month2_beginning = datetime_to_timestamp(min_dt.replace(day=1) + relativedelta(months=+1))
+        mock_backend().get_sla_range.return_value = min_dt, max_dt
+        mock_backend().get_slas.return_value = {itservice.backend_id: [99.0, 100.0]}
+        mock_backend().get_triggers_events.return_value = {
+            'TRIGGER': [
+                {'timestamp': month2_beginning - 10, 'value': '1'},
+                {'timestamp': month2_beginning + 10, 'value': '0'},
+            ]
+        }
+
+        pull_sla(itservice.host.uuid)
+
+        events = models.SlaHistoryEvent.objects.filter(history__itservice=itservice)
+        self.assertEqual(events.get(history__period=format_period(min_dt)).state, 'D')
+        self.assertEqual(events.get(history__period=format_period(max_dt)).state, 'U')
+
+
+class SettingsSlaUpdateTest(test.APITransactionTestCase):
+
+    def setUp(self):
+        spl = factories.ZabbixServiceProjectLinkFactory()
+        self.itservices = [
+            factories.ITServiceFactory(
+                service_project_link=spl,
+                host=factories.HostFactory(service_project_link=spl),
+                backend_trigger_id='trigger-%s' % i)
+            for i in range(2)
+        ]
+        self.settings = spl.service.settings
+        self.period = format_period(datetime.date.today())
+
+    @mock.patch('waldur_core.structure.models.ServiceProjectLink.get_backend')
+    def test_slas_of_all_settings_itservices_are_fetched_with_one_call(self, mock_backend):
+        mock_backend().get_slas.return_value = {
+            self.itservices[0].backend_id: [99.5],
+            self.itservices[1].backend_id: [100.0],
+        }
+        mock_backend().get_triggers_events.return_value = {
+            'trigger-0': [{'timestamp': '150', 'value': '1'}, {'timestamp': '160', 'value': '0'}],
+        }
+
+        update_settings_sla(self.settings.pk, self.period, 100, 200)
+
+        mock_backend().get_slas.assert_called_once_with(
+            [itservice.backend_id for itservice in self.itservices], [(100, 200)])
+        history = models.SlaHistory.objects.get(itservice=self.itservices[1], period=self.period)
+        self.assertEqual(history.value, 100)
+        events = models.SlaHistoryEvent.objects.filter(history__itservice=self.itservices[0])
+        self.assertEqual(set(events.values_list('timestamp', 'state')), {(150, 'D'), (160, 'U')})
+
+    @mock.patch('waldur_core.structure.models.ServiceProjectLink.get_backend')
+    def test_itservice_missing_in_response_does_not_prevent_update_of_others(self, mock_backend):
+        mock_backend().get_slas.return_value = {self.itservices[1].backend_id: [100.0]}
+        mock_backend().get_triggers_events.return_value = {
+            'trigger-0': [{'timestamp': '150', 'value': '1'}],
+            'trigger-1': [{'timestamp': '170', 'value': '1'}],
+        }
+
+        update_settings_sla(self.settings.pk, self.period, 100, 200)
+
+        history = models.SlaHistory.objects.get(itservice=self.itservices[1], period=self.period)
+        self.assertEqual(history.value, 100)
+        self.assertEqual(models.SlaHistoryEvent.objects.get(history=history).timestamp, 170)
+        self.assertFalse(models.SlaHistory.objects.filter(itservice=self.itservices[0]).exists())
+
+    @mock.patch('waldur_core.structure.models.ServiceProjectLink.get_backend')
+    def test_existing_events_are_not_duplicated(self, mock_backend):
+        mock_backend().get_slas.return_value = {itservice.backend_id: [99.5] for itservice in self.itservices}
+        mock_backend().get_triggers_events.return_value = {'trigger-0': [{'timestamp': '150', 'value': '1'}]}
+
+        update_settings_sla(self.settings.pk, self.period, 100, 200)
+        update_settings_sla(self.settings.pk, self.period, 100, 200)
+
+        self.assertEqual(models.SlaHistoryEvent.objects.filter(history__itservice=self.itservices[0]).count(), 1)
+
+    @mock.patch('waldur_core.structure.models.ServiceProjectLink.get_backend')
+    def test_only_events_newer_than_last_ingested_are_fetched(self, mock_backend):
+        mock_backend().get_slas.return_value = {itservice.backend_id: [99.5] for itservice in self.itservices}
+        mock_backend().get_triggers_events.return_value = {
+            'trigger-0': [{'timestamp': '150', 'value': '1'}],
+            'trigger-1': [{'timestamp': '170', 'value': '1'}],
+        }
+        update_settings_sla(self.settings.pk, self.period, 100, 200)
+        models.SlaHistory.objects.update(events_synced_until=None)
+
+        update_settings_sla(self.settings.pk, self.period, 100, 200)
+
+        mock_backend().get_triggers_events.assert_called_with({'trigger-0', 'trigger-1'}, 150, 200)
+
+    @mock.patch('waldur_core.structure.models.ServiceProjectLink.get_backend')
+    def test_events_are_fetched_starting_from_time_of_last_sync(self, mock_backend):
+        mock_backend().get_slas.return_value = {itservice.backend_id: [99.5] for itservice in self.itservices}
+        mock_backend().get_triggers_events.return_value = {'trigger-0': [{'timestamp': '150', 'value': '1'}]}
+        update_settings_sla(self.settings.pk, self.period, 100, 200)
+
+        update_settings_sla(self.settings.pk, self.period, 100, 200)
+
+        self.assertEqual(set(models.SlaHistory.objects.values_list('events_synced_until', flat=True)), {200})
+        mock_backend().get_triggers_events.assert_called_with({'trigger-0', 'trigger-1'}, 200, 200)
+
+    @mock.patch('waldur_core.structure.models.ServiceProjectLink.get_backend')
+    def test_events_of_itservices_synced_at_different_time_are_fetched_separately(self, mock_backend):
+        mock_backend().get_slas.return_value = {itservice.backend_id: [99.5] for itservice in self.itservices}
+        mock_backend().get_triggers_events.return_value = {}
+        for itservice, synced_until in zip(self.itservices, (120, 160)):
+            models.SlaHistory.objects.create(
+                itservice=itservice, period=self.period, events_synced_until=synced_until)
+
+        update_settings_sla(self.settings.pk, self.period, 100, 200)
+
+        mock_backend().get_triggers_events.assert_has_calls([
+            mock.call({'trigger-0'}, 120, 200),
+            mock.call({'trigger-1'}, 160, 200),
+        ])
+
+
+class SlaBackendTest(test.APITransactionTestCase):
+    def setUp(self):
+        self.patcher = mock.patch('pyzabbix.ZabbixAPI')
+        self.mocked_api = self.patcher.start()
+        self.backend = factories.ServiceSettingsFactory().get_backend()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_services_missing_in_response_are_skipped(self):
+        self.mocked_api().service.getsla.return_value = {'1': {'sla': [{'sla': 99.5}]}}
+
+        slas = self.backend.get_slas(['1', '2'], [(100, 200)])
+
+        self.assertEqual(slas, {'1': [99.5]})
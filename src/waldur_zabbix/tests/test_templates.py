@@ -0,0 +1,113 @@
+import mock
+
+from django.test import TestCase
+
+from . import factories
+from .. import models
+
+
+class TemplatesPullTest(TestCase):
+    def setUp(self):
+        self.patcher = mock.patch('pyzabbix.ZabbixAPI')
+        self.mocked_api = self.patcher.start()
+        self.settings = factories.ServiceSettingsFactory()
+        self.backend = self.settings.get_backend()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def get_zabbix_template(self, templateid, name, triggers=(), items=(), templates=()):
+        return {
+            'templateid': templateid,
+            'name': name,
+            'triggers': [{'triggerid': t, 'description': 'Trigger %s' % t, 'priority': '2'} for t in triggers],
+            'items': [{'itemid': i, 'name': 'Item %s' % i, 'key_': 'key.%s' % i, 'value_type': '0',
+                       'units': 'B', 'history': '7', 'delay': '60'} for i in items],
+            'templates': [{'templateid': t} for t in templates],
+        }
+
+    def test_templates_triggers_items_and_children_are_created(self):
+        self.mocked_api().template.get.return_value = [
+            self.get_zabbix_template('1', 'Parent', triggers=['10'], items=['100', '101'], templates=['2']),
+            self.get_zabbix_template('2', 'Child', items=['102']),
+        ]
+
+        self.backend.pull_templates()
+
+        parent = models.Template.objects.get(settings=self.settings, backend_id='1')
+        child = models.Template.objects.get(settings=self.settings, backend_id='2')
+        self.assertEqual(set(parent.items.values_list('backend_id', flat=True)), {'100', '101'})
+        self.assertEqual(parent.triggers.get().priority, 2)
+        self.assertEqual(list(parent.children.all()), [child])
+
+    def test_changed_objects_are_updated_and_stale_are_deleted(self):
+        self.mocked_api().template.get.return_value = [
+            self.get_zabbix_template('1', 'Parent', triggers=['10', '11'], items=['100', '101'], templates=['2']),
+            self.get_zabbix_template('2', 'Child'),
+            self.get_zabbix_template('3', 'Stale'),
+        ]
+        self.backend.pull_templates()
+
+        zabbix_template = self.get_zabbix_template('1', 'Renamed', triggers=['10'], items=['100'])
+        zabbix_template['items'][0]['units'] = '%'
+        zabbix_template['triggers'][0]['priority'] = '4'
+        self.mocked_api().template.get.return_value = [zabbix_template, self.get_zabbix_template('2', 'Child')]
+        self.backend.pull_templates()
+
+        template = models.Template.objects.get(settings=self.settings, backend_id='1')
+        self.assertEqual(template.name, 'Renamed')
+        self.assertEqual(template.items.get().units, '%')
+        self.assertEqual(template.triggers.get().priority, 4)
+        self.assertFalse(template.children.exists())
+        self.assertFalse(models.Template.objects.filter(settings=self.settings, backend_id='3').exists())
+
+    def test_incremental_pull_fetches_details_only_for_changed_templates(self):
+        self.mocked_api().template.get.return_value = [
+            self.get_zabbix_template('1', 'First', items=['100']),
+            self.get_zabbix_template('2', 'Second', items=['101']),
+        ]
+        self.backend.pull_templates()
+
+        changed_template = self.get_zabbix_template('2', 'Second', items=['101', '102'])
+        self.mocked_api().template.get.side_effect = [
+            [self.get_zabbix_template('1', 'First', items=['100']), changed_template],
+            [changed_template],
+        ]
+        self.backend.pull_templates(incremental=True)
+
+        listing_call, details_call = self.mocked_api().template.get.call_args_list[-2:]
+        self.assertEqual(listing_call[1]['selectItems'], ['itemid', 'key_', 'value_type', 'units', 'history', 'delay'])
+        self.assertEqual(details_call, mock.call(
+            templateids=['2'],
+            output=['name', 'templateid'],
+            selectTriggers=['description', 'triggerid', 'priority'],
+            selectItems=['itemid', 'name', 'key_', 'value_type', 'units', 'history', 'delay'],
+            selectTemplates=['templateid'],
+        ))
+        template = models.Template.objects.get(settings=self.settings, backend_id='2')
+        self.assertEqual(set(template.items.values_list('backend_id', flat=True)), {'101', '102'})
+        self.assertTrue(models.Template.objects.get(settings=self.settings, backend_id='1').items.exists())
+
+    def test_incremental_pull_fetches_templates_with_changed_attributes_of_items_and_triggers(self):
+        self.mocked_api().template.get.return_value = [
+            self.get_zabbix_template('1', 'First', triggers=['10'], items=['100'])]
+        self.backend.pull_templates()
+
+        zabbix_template = self.get_zabbix_template('1', 'First', triggers=['10'], items=['100'])
+        zabbix_template['items'][0]['units'] = '%'
+        zabbix_template['triggers'][0]['priority'] = '4'
+        self.mocked_api().template.get.return_value = [zabbix_template]
+        self.backend.pull_templates(incremental=True)
+
+        template = models.Template.objects.get(settings=self.settings, backend_id='1')
+        self.assertEqual(template.items.get().units, '%')
+        self.assertEqual(template.triggers.get().priority, 4)
+
+    def test_incremental_pull_does_not_fetch_details_if_nothing_changed(self):
+        zabbix_templates = [self.get_zabbix_template('1', 'First', items=['100'])]
+        self.mocked_api().template.get.return_value = zabbix_templates
+        self.backend.pull_templates()
+
+        self.backend.pull_templates(incremental=True)
+
+        self.assertEqual(self.mocked_api().template.get.call_count, 2)
@@ -1,10 +1,16 @@
+import json
+import threading
+
 import mock
+from django.conf import settings
+from django.core.cache import cache
 from rest_framework import test
 
 from waldur_core.structure.tests import factories as structure_factories
 
 from . import factories
 from .. import models
+from ..backend import ZabbixResponseCache
 
 
 class TriggerQueryTest(test.APITransactionTestCase):
@@ -39,3 +45,150 @@ class TriggerQueryTest(test.APITransactionTestCase):
         })
 
         self.assertEqual(kwargs['withUnacknowledgedEvents'], 1)
+
+
+class TriggerStatusCacheTest(test.APITransactionTestCase):
+    def setUp(self):
+        patcher = mock.patch('pyzabbix.ZabbixAPI')
+        self.mocked_api = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mocked_api().trigger.get.return_value = []
+        self.backend = factories.ZabbixServiceFactory().get_backend()
+        self.addCleanup(cache.clear)
+
+    def test_identical_requests_are_served_from_cache(self):
+        self.backend.get_trigger_status({'value': 1})
+        self.backend.get_trigger_status({'value': 1})
+
+        self.assertEqual(self.mocked_api().trigger.get.call_count, 1)
+
+    def test_different_requests_are_not_mixed(self):
+        self.backend.get_trigger_status({'value': 1})
+        self.backend.get_trigger_status({'value': 0})
+
+        self.assertEqual(self.mocked_api().trigger.get.call_count, 2)
+
+    def test_cache_is_disabled_if_timeout_is_zero(self):
+        zabbix_settings = dict(settings.WALDUR_ZABBIX, TRIGGER_STATUS_CACHE_TIMEOUT=0)
+        with self.settings(WALDUR_ZABBIX=zabbix_settings):
+            self.backend.get_trigger_status({'value': 1})
+            self.backend.get_trigger_status({'value': 1})
+
+        self.assertEqual(self.mocked_api().trigger.get.call_count, 2)
+
+
+class ZabbixResponseCacheTest(test.APITransactionTestCase):
+    def setUp(self):
+        self.response_cache = ZabbixResponseCache()
+        self.addCleanup(cache.clear)
+
+    def test_concurrent_identical_calls_are_coalesced(self):
+        started = threading.Event()
+        release = threading.Event()
+        func = mock.Mock(side_effect=lambda: started.set() or release.wait() or ['trigger'])
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(self.response_cache.get('key', 10, func)))
+        leader.start()
+        started.wait()
+        follower = threading.Thread(target=lambda: results.append(self.response_cache.get('key', 10, func)))
+        follower.start()
+        release.set()
+        leader.join()
+        follower.join()
+
+        self.assertEqual(func.call_count, 1)
+        self.assertEqual(results, [['trigger'], ['trigger']])
+
+
+class TriggerStatusTest(test.APITransactionTestCase):
+    def setUp(self):
+        patcher = mock.patch('pyzabbix.ZabbixAPI')
+        self.mocked_api = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(cache.clear)
+        self.mocked_api().auth = 'token'
+        self.backend = factories.ZabbixServiceFactory().get_backend()
+
+    def test_events_counts_and_hosts_names_are_joined_with_triggers(self):
+        self.mocked_api().trigger.get.return_value = [
+            self.get_backend_trigger('1', hostids=['10', '20']),
+            self.get_backend_trigger('2', hostids=['30']),
+        ]
+        events = [{'objectid': '1', 'rowscount': '5'}]
+        hosts = [{'hostid': '10', 'host': 'first'}, {'hostid': '20', 'host': 'second'}]
+        self.mocked_api().session.post.return_value.json.return_value = [
+            {'id': 0, 'result': events}, {'id': 1, 'result': hosts}]
+
+        triggers = self.backend.get_trigger_status({'include_events_count': True, 'include_trigger_hosts': True})
+
+        self.assertEqual(triggers[0]['event_count'], '5')
+        self.assertEqual(triggers[0]['hosts'], [{'id': '10', 'name': 'first'}, {'id': '20', 'name': 'second'}])
+        self.assertEqual(triggers[1]['event_count'], 0)
+        self.assertEqual(triggers[1]['hosts'], [{'id': '30', 'name': ''}])
+
+    @staticmethod
+    def get_backend_trigger(triggerid, hostids):
+        return {
+            'triggerid': triggerid,
+            'lastchange': '1500000000',
+            'priority': '1',
+            'description': 'Trigger',
+            'expression': '{1}>0',
+            'comments': '',
+            'error': '',
+            'value': '1',
+            'hosts': [{'hostid': hostid} for hostid in hostids],
+        }
+
+    def test_only_triggers_of_requested_page_are_fetched(self):
+        self.mocked_api().trigger.get.side_effect = [
+            [{'triggerid': triggerid} for triggerid in ('4', '3', '2', '1')],
+            [self.get_backend_trigger('1', hostids=[]), self.get_backend_trigger('2', hostids=[])],
+        ]
+        self.mocked_api().session.post.return_value.json.return_value = [{'id': 0, 'result': []}]
+
+        triggers = self.backend.get_trigger_status({'include_events_count': True}, offset=2, limit=2)
+
+        ids_kwargs = self.mocked_api().trigger.get.call_args_list[0][1]
+        page_kwargs = self.mocked_api().trigger.get.call_args_list[1][1]
+        self.assertEqual(ids_kwargs['limit'], 4)
+        self.assertEqual(page_kwargs['triggerids'], ['2', '1'])
+        self.assertEqual([trigger['backend_id'] for trigger in triggers], ['2', '1'])
+        events_request = json.loads(self.mocked_api().session.post.call_args[1]['data'])
+        self.assertEqual(events_request[0]['params']['objectids'], ['2', '1'])
+
+    def test_triggers_are_ordered_by_last_change_with_and_without_pagination(self):
+        self.mocked_api().trigger.get.return_value = []
+
+        self.backend.get_trigger_status({})
+        self.backend.get_trigger_status({}, offset=0, limit=10)
+
+        all_kwargs, page_ids_kwargs = [call[1] for call in self.mocked_api().trigger.get.call_args_list]
+        for kwargs in (all_kwargs, page_ids_kwargs):
+            self.assertEqual(kwargs['sortfield'], ['lastchange', 'triggerid'])
+            self.assertEqual(kwargs['sortorder'], 'DESC')
+
+
+class TriggerStatusStreamingTest(test.APITransactionTestCase):
+    def setUp(self):
+        patcher = mock.patch('pyzabbix.ZabbixAPI')
+        self.mocked_api = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(cache.clear)
+        self.client.force_authenticate(structure_factories.UserFactory(is_staff=True))
+        self.service = factories.ZabbixServiceFactory()
+
+    def test_triggers_are_streamed_as_ndjson(self):
+        self.mocked_api().trigger.get.side_effect = [
+            '2',
+            [{'triggerid': '1'}, {'triggerid': '2'}],
+            [TriggerStatusTest.get_backend_trigger('1', []), TriggerStatusTest.get_backend_trigger('2', [])],
+        ]
+
+        url = factories.ZabbixServiceFactory.get_url(self.service, action='trigger_status')
+        response = self.client.get(url, {'stream': 1})
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['backend_id'] for line in lines], ['1', '2'])
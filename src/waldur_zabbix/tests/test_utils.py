@@ -1,3 +1,5 @@
+import threading
+import time
 import unittest
 
 from .. import utils
@@ -18,3 +20,31 @@ class TimeParserTest(unittest.TestCase):
 
     def test_invalid_input_value_raises_error(self):
         self.assertRaises(ValueError, utils.parse_time, 'y10')
+
+
+class RunInThreadsTest(unittest.TestCase):
+    def test_results_are_returned_in_order_of_arguments(self):
+        results = utils.run_in_threads(lambda x: x * 2, [(1,), (2,), (3,)], max_workers=2)
+        self.assertEqual(results, [2, 4, 6])
+
+    def test_number_of_threads_is_limited(self):
+        active = []
+        max_active = []
+        lock = threading.Lock()
+
+        def func(x):
+            with lock:
+                active.append(x)
+                max_active.append(len(active))
+            time.sleep(0.01)
+            with lock:
+                active.remove(x)
+
+        utils.run_in_threads(func, [(x,) for x in range(10)], max_workers=3)
+        self.assertLessEqual(max(max_active), 3)
+
+    def test_exception_is_reraised(self):
+        def func(x):
+            raise ValueError(x)
+
+        self.assertRaises(ValueError, utils.run_in_threads, func, [(1,), (2,)], max_workers=2)
@@ -1,3 +1,12 @@
+import sys
+import threading
+
+from django.conf import settings as django_settings
+from django.db import connections
+from django.db.models import Case, Value, When
+from django.utils import six
+
+
 TIME_SUFFIXES = {
     's': 1,
     'm': 60,
@@ -26,3 +35,75 @@ def parse_time(value):
             return int(stripped) * factor
 
     raise ValueError('Invalid time value %s' % value)
+
+
+def bulk_update(objects, fields, batch_size=500):
+    """
+    Update given fields of model instances with one query per batch.
+    QuerySet.bulk_update is not available in Django 1.11, so CASE expression is used instead.
+    """
+    if not objects:
+        return
+
+    model = type(objects[0])
+    for index in range(0, len(objects), batch_size):
+        batch = objects[index:index + batch_size]
+        values = {}
+        for name in fields:
+            field = model._meta.get_field(name)
+            whens = [When(pk=obj.pk, then=Value(getattr(obj, field.attname), output_field=field)) for obj in batch]
+            values[field.attname] = Case(*whens, output_field=field)
+        model.objects.filter(pk__in=[obj.pk for obj in batch]).update(**values)
+
+
+def run_in_threads(func, args_list, max_workers):
+    """
+    Call func with each arguments tuple using at most max_workers threads.
+    Returns results in the same order as arguments. First raised exception is re-raised.
+    Database connections opened by worker threads are closed when the thread is done.
+    """
+    if max_workers <= 1 or len(args_list) <= 1:
+        return [func(*args) for args in args_list]
+
+    results = [None] * len(args_list)
+    errors = []
+    tasks = six.moves.queue.Queue()
+    for index, args in enumerate(args_list):
+        tasks.put((index, args))
+
+    def worker():
+        try:
+            while not errors:
+                try:
+                    index, args = tasks.get_nowait()
+                except six.moves.queue.Empty:
+                    return
+                results[index] = func(*args)
+        except Exception:
+            errors.append(sys.exc_info())
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker) for _ in range(min(max_workers, len(args_list)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        six.reraise(*errors[0])
+    return results
+
+
+def get_query_timeout(endpoint=None):
+    """
+    Get execution time limit of Zabbix DB queries in seconds for given endpoint.
+    Limit of 'default' key is used if endpoint does not have its own limit.
+    """
+    timeouts = getattr(django_settings, 'WALDUR_ZABBIX', {}).get('QUERY_TIMEOUTS') or {}
+    return timeouts.get(endpoint, timeouts.get('default'))
+
+
+def get_max_concurrent_queries():
+    """ Get maximum number of Zabbix DB queries that are executed in parallel to serve one request """
+    return getattr(django_settings, 'WALDUR_ZABBIX', {}).get('MAX_CONCURRENT_QUERIES', 5)
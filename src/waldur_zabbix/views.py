@@ -1,9 +1,12 @@
 from collections import defaultdict
 
-from rest_framework import status, exceptions, response
+from django.http import StreamingHttpResponse
+from rest_framework import status, exceptions, renderers, response
 from rest_framework.decorators import detail_route, list_route
 from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
 
 from waldur_core.core.exceptions import IncorrectStateException
 from waldur_core.core.serializers import HistorySerializer
@@ -11,10 +14,45 @@ from waldur_core.core.utils import datetime_to_timestamp, pwgen
 from waldur_core.monitoring.utils import get_period
 from waldur_core.structure import views as structure_views
 
-from . import models, serializers, filters, executors
+from . import models, serializers, filters, executors, utils
 from .managers import filter_active
 
 
+class NDJSONRenderer(renderers.BaseRenderer):
+    """ Render list as newline delimited JSON, one element per line. """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = [data]
+        return ''.join(ndjson_lines(data or [])).encode(self.charset)
+
+
+STREAMING_RENDERER_CLASSES = list(api_settings.DEFAULT_RENDERER_CLASSES) + [NDJSONRenderer]
+
+
+def ndjson_lines(rows):
+    encoder = JSONEncoder()
+    for row in rows:
+        yield encoder.encode(row) + '\n'
+
+
+def is_streaming_requested(request):
+    """ Streaming is requested with ?stream=1 parameter or NDJSON Accept header """
+    return (request.query_params.get('stream') in ('1', 'true', 'True') or
+            NDJSONRenderer.media_type in request.META.get('HTTP_ACCEPT', ''))
+
+
+def streaming_response(rows, headers=None):
+    """ Render rows as NDJSON while they are produced, so response is not kept in memory """
+    response = StreamingHttpResponse(ndjson_lines(rows), content_type=NDJSONRenderer.media_type)
+    for name, value in (headers or {}).items():
+        response[name] = value
+    return response
+
+
 class ZabbixServiceViewSet(structure_views.BaseServiceViewSet):
     queryset = models.ZabbixService.objects.all()
     serializer_class = serializers.ServiceSerializer
@@ -42,8 +80,13 @@ class ZabbixServiceViewSet(structure_views.BaseServiceViewSet):
             executors.ServiceSettingsPasswordResetExecutor.execute(service.settings, password=password)
             return Response({'password': password})
 
-    @detail_route(methods=['GET', 'HEAD'])
+    @detail_route(methods=['GET', 'HEAD'], renderer_classes=STREAMING_RENDERER_CLASSES)
     def trigger_status(self, request, uuid):
+        """ Get status of triggers that match query.
+
+        Send *?stream=1* parameter or *Accept: application/x-ndjson* header to get
+        triggers as newline delimited JSON which is streamed while triggers are fetched.
+        """
         serializer_class = self.get_serializer_class()
         serializer = serializer_class(data=request.query_params)
         serializer.is_valid(raise_exception=True)
@@ -58,17 +101,48 @@ class ZabbixServiceViewSet(structure_views.BaseServiceViewSet):
         if request.method == 'HEAD':
             return Response(headers=headers)
 
-        backend_triggers = backend.get_trigger_status(query)
-        response_serializer = serializers.TriggerResponseSerializer(
-            instance=backend_triggers, many=True)
+        if is_streaming_requested(request):
+            rows = (serializers.TriggerResponseSerializer(instance=trigger).data
+                    for trigger in backend.iter_trigger_status(query))
+            return streaming_response(rows, headers)
 
-        page = self.paginate_queryset(response_serializer.data)
+        # Only triggers of requested page are fetched from backend
+        triggers = TriggerStatusList(backend, query, headers['X-Result-Count'])
+        page = self.paginate_queryset(triggers)
         if page is not None:
             return self.get_paginated_response(page)
 
+        backend_triggers = backend.get_trigger_status(query)
+        response_serializer = serializers.TriggerResponseSerializer(
+            instance=backend_triggers, many=True)
+
         return Response(response_serializer.data, headers=headers)
 
 
+class TriggerStatusList(object):
+    """
+    Lazy list of serialized triggers that is sliced by paginator.
+    Each slice is fetched from backend with its own offset and limit.
+    """
+    def __init__(self, backend, query, count):
+        self.backend = backend
+        self.query = query
+        self.size = count
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+
+        start, stop, step = index.indices(self.size)
+        if step != 1:
+            raise ValueError('Trigger list does not support slice step.')
+        backend_triggers = self.backend.get_trigger_status(self.query, offset=start, limit=max(stop - start, 0))
+        return serializers.TriggerResponseSerializer(instance=backend_triggers, many=True).data
+
+
 class ZabbixServiceProjectLinkViewSet(structure_views.BaseServiceProjectLinkViewSet):
     queryset = models.ZabbixServiceProjectLink.objects.all()
     serializer_class = serializers.ServiceProjectLinkSerializer
@@ -102,7 +176,7 @@ class HostViewSet(structure_views.ResourceViewSet):
     update_executor = executors.HostUpdateExecutor
     delete_executor = executors.HostDeleteExecutor
 
-    @detail_route()
+    @detail_route(renderer_classes=STREAMING_RENDERER_CLASSES)
     def items_history(self, request, uuid):
         """ Get host items historical values.
 
@@ -116,19 +190,26 @@ class HostViewSet(structure_views.ResourceViewSet):
 
         Also you should specify one or more name of host template items, for example 'openstack.instance.cpu_util'
 
+        Each point, except the last one, gets the latest value of interval between this point and the next one.
+
+        Optionally send *?downsample=<method>* parameter together with start, end and points_count
+        to aggregate all values of the same interval. Choices: avg, min, max, last.
+
         Response is list of datapoints, each of which is dictionary with following fields:
          - 'point' - timestamp;
          - 'value' - values are converted from bytes to megabytes, if possible;
          - 'item' - key of host template item;
          - 'item_name' - name of host template item.
+
+        Send *?stream=1* parameter or *Accept: application/x-ndjson* header to get
+        datapoints as newline delimited JSON. History is fetched and streamed item by item.
         """
         host = self.get_object()
         if host.state != models.Host.States.OK:
             raise IncorrectStateException('Host has to be OK to get items history.')
-        stats = self._get_stats(request, [host])
-        return Response(stats, status=status.HTTP_200_OK)
+        return self._get_stats_response(request, [host])
 
-    @list_route()
+    @list_route(renderer_classes=STREAMING_RENDERER_CLASSES)
     def aggregated_items_history(self, request):
         """ Get sum of hosts historical values.
 
@@ -136,8 +217,7 @@ class HostViewSet(structure_views.ResourceViewSet):
         Host filtering parameters are the same as for */api/zabbix-hosts/* endpoint.
         Input/output format is the same as for **/api/zabbix-hosts/<host_uuid>/items_history/** endpoint.
         """
-        stats = self._get_stats(request, self._get_hosts())
-        return Response(stats, status=status.HTTP_200_OK)
+        return self._get_stats_response(request, self._get_hosts())
 
     @list_route()
     def items_aggregated_values(self, request):
@@ -159,13 +239,23 @@ class HostViewSet(structure_views.ResourceViewSet):
         filter_data = serializer.validated_data
         items = self._get_items(request, hosts)
 
+        def get_settings_aggregated_values(settings, settings_hosts):
+            backend = settings.get_backend()
+            backend.query_timeout = utils.get_query_timeout(self.action)
+            return backend.get_hosts_items_aggregated_values(
+                [host.backend_id for host in settings_hosts], items,
+                filter_data['start'], filter_data['end'], filter_data['method'])
+
+        # Values of all hosts of the same settings are aggregated by one query, settings are queried in parallel
+        settings_aggregated_values = utils.run_in_threads(
+            get_settings_aggregated_values, list(self._group_hosts_by_settings(hosts).items()),
+            utils.get_max_concurrent_queries())
+
         aggregated_data = defaultdict(lambda: 0)
-        for host in hosts:
-            backend = host.get_backend()
-            host_aggregated_values = backend.get_items_aggregated_values(
-                host, items, filter_data['start'], filter_data['end'], filter_data['method'])
-            for key, value in host_aggregated_values.items():
-                aggregated_data[key] += value
+        for hosts_aggregated_values in settings_aggregated_values:
+            for host_aggregated_values in hosts_aggregated_values.values():
+                for key, value in host_aggregated_values.items():
+                    aggregated_data[key] += value
         return Response(aggregated_data, status=status.HTTP_200_OK)
 
     # TODO: make methods items_aggregated_values and items_values DRY.
@@ -179,12 +269,14 @@ class HostViewSet(structure_views.ResourceViewSet):
         items = self._get_items(request, [host])
 
         backend = host.get_backend()
+        backend.query_timeout = utils.get_query_timeout(self.action)
         host_aggregated_values = backend.get_items_aggregated_values(
             host, items, filter_data['start'], filter_data['end'], filter_data['method'])
         return Response(host_aggregated_values, status=status.HTTP_200_OK)
 
     def _get_hosts(self):
         hosts = filter_active(self.filter_queryset(self.get_queryset()))
+        hosts = hosts.select_related('service_project_link__service__settings')
         if not hosts:
             raise NoHostsException()
         return hosts
@@ -196,11 +288,14 @@ class HostViewSet(structure_views.ResourceViewSet):
             raise NoItemsException()
         return items
 
-    def _get_stats(self, request, hosts):
-        """
-        If item list contains several elements, result is ordered by item
-        (in the same order as it has been provided in request) and then by time.
-        """
+    def _get_stats_response(self, request, hosts):
+        items, points, downsample = self._get_stats_parameters(request, hosts)
+        if is_streaming_requested(request):
+            return streaming_response(self._iter_stats(hosts, items, points, downsample, items_per_query=1))
+        stats = list(self._iter_stats(hosts, items, points, downsample))
+        return Response(stats, status=status.HTTP_200_OK)
+
+    def _get_stats_parameters(self, request, hosts):
         items = self._get_items(request, hosts)
         numeric_types = (models.Item.ValueTypes.FLOAT, models.Item.ValueTypes.INTEGER)
         non_numeric_items = [item.name for item in items if item.value_type not in numeric_types]
@@ -208,22 +303,54 @@ class HostViewSet(structure_views.ResourceViewSet):
             raise exceptions.ValidationError(
                 'Cannot show historical data for non-numeric items: %s' % ', '.join(non_numeric_items))
         points = self._get_points(request)
+        serializer = serializers.ItemsHistoryDownsamplingSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return list(items), list(points), serializer.validated_data.get('downsample')
 
-        stats = []
-        for item in items:
-            values = self._sum_rows([
-                host.get_backend().get_item_stats(host.backend_id, item, points)
-                for host in hosts
-            ])
-
-            for point, value in zip(points, values):
-                stats.append({
-                    'point': point,
-                    'item': item.key,
-                    'item_name': item.name,
-                    'value': value,
-                })
-        return stats
+    def _iter_stats(self, hosts, items, points, downsample=None, items_per_query=None):
+        """
+        If item list contains several elements, result is ordered by item
+        (in the same order as it has been provided in request) and then by time.
+        By default history of all items is fetched at once, items_per_query limits
+        number of items which history is kept in memory at the same time.
+        """
+        hosts_by_settings = self._group_hosts_by_settings(hosts)
+        items_per_query = items_per_query or len(items)
+        for index in range(0, len(items), items_per_query):
+            items_chunk = items[index:index + items_per_query]
+
+            def get_settings_stats(settings, settings_hosts):
+                backend = settings.get_backend()
+                backend.query_timeout = utils.get_query_timeout(self.action)
+                hostids = [host.backend_id for host in settings_hosts]
+                if downsample:
+                    return backend.get_items_downsampled_stats(hostids, items_chunk, points, downsample)
+                return backend.get_items_stats(hostids, items_chunk, points)
+
+            # Fetch history of all hosts of the same settings in one batch, settings are queried in parallel
+            settings_list = list(hosts_by_settings.items())
+            settings_stats = utils.run_in_threads(get_settings_stats, settings_list, utils.get_max_concurrent_queries())
+            hosts_stats = {settings: stats for (settings, _), stats in zip(settings_list, settings_stats)}
+
+            for item in items_chunk:
+                values = self._sum_rows([
+                    hosts_stats[host.service_project_link.service.settings][host.backend_id][item.key]
+                    for host in hosts
+                ])
+
+                for point, value in zip(points, values):
+                    yield {
+                        'point': point,
+                        'item': item.key,
+                        'item_name': item.name,
+                        'value': value,
+                    }
+
+    def _group_hosts_by_settings(self, hosts):
+        hosts_by_settings = defaultdict(list)
+        for host in hosts:
+            hosts_by_settings[host.service_project_link.service.settings].append(host)
+        return hosts_by_settings
 
     def _get_points(self, request):
         mapped = {